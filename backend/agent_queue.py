@@ -1,11 +1,37 @@
-import os, time, json, sqlite3
+import os, time, json, sqlite3, threading
 from typing import Optional, Dict, Any, List, Tuple
 
 DB_PATH = os.getenv("STATION_AGENT_DB", os.path.join(os.path.dirname(__file__), "agent_queue.sqlite3"))
 
-def _db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA journal_mode=WAL;")
+# Claims are leases: a runner owns a task until lease_until, extends it with
+# heartbeat(), and expired leases are re-queued by reap_expired() (run
+# automatically from claim_batch at most every REAP_EVERY seconds).
+LEASE_SEC = int(os.getenv("STATION_AGENT_LEASE_SEC", "300"))
+MAX_ATTEMPTS = int(os.getenv("STATION_AGENT_MAX_ATTEMPTS", "5"))
+REAP_EVERY = 15
+_LAST_REAP = 0.0
+
+# Scheduling: higher priority always goes first; among tasks of equal
+# priority, task types share the claims in proportion to their weight
+# (stride scheduling on a per-process virtual clock), so one bulk producer
+# cannot starve the others. Weights: STATION_AGENT_TYPE_WEIGHTS='{"llm": 3}'.
+TYPE_WEIGHTS: Dict[str, float] = json.loads(os.getenv("STATION_AGENT_TYPE_WEIGHTS") or "{}")
+_VTIME: Dict[str, float] = {}
+_SCHED_LOCK = threading.Lock()
+
+# UPDATE ... RETURNING needs SQLite 3.35+
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# One connection per thread (and per process, connections must not cross a fork),
+# kept open for the life of the thread. sqlite3 caches prepared statements per
+# connection, so reusing it also reuses the compiled queries.
+_LOCAL = threading.local()
+_SCHEMA_LOCK = threading.Lock()
+_SCHEMA_READY = set()
+
+_COLS = "id, created_at, status, runner_id, task_type, payload_json, result_json, error_text, lease_until, attempts, priority"
+
+def _init_schema(conn: sqlite3.Connection) -> None:
     conn.execute("""
     CREATE TABLE IF NOT EXISTS tasks (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -18,62 +44,44 @@ def _db():
         error_text TEXT
     )
     """)
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(tasks)")}
+    if "lease_until" not in cols:
+        conn.execute("ALTER TABLE tasks ADD COLUMN lease_until INTEGER")
+        # tasks claimed before leases existed get one lease to report back
+        conn.execute("UPDATE tasks SET lease_until=? WHERE status='running'", (_now() + LEASE_SEC,))
+    if "attempts" not in cols:
+        conn.execute("ALTER TABLE tasks ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    if "priority" not in cols:
+        conn.execute("ALTER TABLE tasks ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_sched ON tasks(status, task_type, priority DESC, created_at, id)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_lease ON tasks(status, lease_until)")
     conn.commit()
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, timeout=30, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA busy_timeout=30000;")
+    key = (os.getpid(), DB_PATH)
+    if key not in _SCHEMA_READY:
+        with _SCHEMA_LOCK:
+            if key not in _SCHEMA_READY:
+                _init_schema(conn)
+                _SCHEMA_READY.add(key)
     return conn
 
+def _db() -> sqlite3.Connection:
+    key = (os.getpid(), DB_PATH)
+    if getattr(_LOCAL, "key", None) != key:
+        _LOCAL.conn = _connect()
+        _LOCAL.key = key
+    return _LOCAL.conn
+
 def _now() -> int:
     return int(time.time())
 
-def submit_task(task_type: str, payload: Dict[str, Any]) -> int:
-    conn = _db()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO tasks(created_at, status, runner_id, task_type, payload_json) VALUES(?, 'queued', NULL, ?, ?)",
-        (_now(), task_type, json.dumps(payload, ensure_ascii=True)),
-    )
-    conn.commit()
-    tid = int(cur.lastrowid)
-    conn.close()
-    return tid
-
-def claim_next(runner_id: str) -> Optional[Tuple[int, Dict[str, Any], str]]:
-    conn = _db()
-    cur = conn.cursor()
-    cur.execute("SELECT id, payload_json, task_type FROM tasks WHERE status='queued' ORDER BY created_at ASC LIMIT 1")
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        return None
-    tid, payload_json, task_type = row
-    cur.execute("UPDATE tasks SET status='running', runner_id=? WHERE id=? AND status='queued'", (runner_id, tid))
-    conn.commit()
-    cur.execute("SELECT status FROM tasks WHERE id=?", (tid,))
-    st = cur.fetchone()
-    if not st or st[0] != "running":
-        conn.close()
-        return None
-    conn.close()
-    return int(tid), json.loads(payload_json), str(task_type)
-
-def set_result(tid: int, ok: bool, result: Dict[str, Any], error_text: str = "") -> None:
-    conn = _db()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE tasks SET status=?, result_json=?, error_text=? WHERE id=?",
-        ("done" if ok else "failed", json.dumps(result, ensure_ascii=True), error_text, tid),
-    )
-    conn.commit()
-    conn.close()
-
-def get_task(tid: int) -> Optional[Dict[str, Any]]:
-    conn = _db()
-    cur = conn.cursor()
-    cur.execute("SELECT id, created_at, status, runner_id, task_type, payload_json, result_json, error_text FROM tasks WHERE id=?", (tid,))
-    row = cur.fetchone()
-    conn.close()
-    if not row:
-        return None
+def _row_to_task(row) -> Dict[str, Any]:
     return {
         "id": row[0],
         "created_at": row[1],
@@ -83,17 +91,201 @@ def get_task(tid: int) -> Optional[Dict[str, Any]]:
         "payload": json.loads(row[5]) if row[5] else None,
         "result": json.loads(row[6]) if row[6] else None,
         "error": row[7],
+        "lease_until": row[8],
+        "attempts": row[9],
+        "priority": row[10],
     }
 
-def list_recent(limit: int = 25) -> List[Dict[str, Any]]:
+def submit_task(task_type: str, payload: Dict[str, Any], priority: int = 0) -> int:
+    conn = _db()
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO tasks(created_at, status, runner_id, task_type, payload_json, priority) VALUES(?, 'queued', NULL, ?, ?, ?)",
+            (_now(), task_type, json.dumps(payload, ensure_ascii=True), int(priority)),
+        )
+    return int(cur.lastrowid)
+
+def _pick(conn: sqlite3.Connection, n: int, task_types: Optional[List[str]] = None) -> List[int]:
+    # top n queued candidates per type, merged by (priority, type fairness).
+    # Every lookup is an idx_tasks_sched seek, so the cost does not grow with
+    # the number of queued rows.
+    if task_types:
+        types = list(dict.fromkeys(task_types))
+    else:
+        # distinct queued types as a loose index scan: one MIN() seek per type
+        types = [r[0] for r in conn.execute(
+            "WITH RECURSIVE t(tt) AS ("
+            " SELECT MIN(task_type) FROM tasks WHERE status='queued'"
+            " UNION ALL"
+            " SELECT (SELECT MIN(task_type) FROM tasks WHERE status='queued' AND task_type > tt)"
+            " FROM t WHERE tt IS NOT NULL"
+            ") SELECT tt FROM t WHERE tt IS NOT NULL"
+        )]
+    rows = []
+    for t in types:
+        rows += conn.execute(
+            "SELECT id, task_type, priority FROM tasks WHERE status='queued' AND task_type=? "
+            "ORDER BY priority DESC, created_at, id LIMIT ?",
+            (t, n),
+        ).fetchall()
+    heads: Dict[str, List[Tuple[int, int]]] = {}
+    for tid, task_type, prio in rows:
+        heads.setdefault(task_type, []).append((int(prio), int(tid)))
+    if not heads:
+        return []
+    picked = []
+    with _SCHED_LOCK:
+        # types (re)joining start at the current floor instead of cashing in idle time
+        known = [_VTIME[t] for t in heads if t in _VTIME]
+        floor = min(known) if known else 0.0
+        for t in heads:
+            _VTIME[t] = max(_VTIME.get(t, floor), floor)
+        pos = {t: 0 for t in heads}
+        while len(picked) < n:
+            live = [t for t in heads if pos[t] < len(heads[t])]
+            if not live:
+                break
+            t = max(live, key=lambda x: (heads[x][pos[x]][0], -_VTIME[x]))
+            picked.append(heads[t][pos[t]][1])
+            pos[t] += 1
+            _VTIME[t] += 1.0 / max(0.01, float(TYPE_WEIGHTS.get(t, 1)))
+    return picked
+
+def claim_batch(runner_id: str, n: int = 1, lease_sec: int = LEASE_SEC,
+                task_types: Optional[List[str]] = None) -> List[Tuple[int, Dict[str, Any], str]]:
+    # atomically hand out up to n queued tasks to one runner, in schedule order;
+    # task_types restricts the runner to those lanes
+    n = max(1, int(n))
+    _maybe_reap()
+    lease_until = _now() + int(lease_sec)
+    conn = _db()
+    # immediate transaction: the write lock is held from candidate selection
+    # through the claim, so concurrent runners never get the same task
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        ids = _pick(conn, n, task_types)
+        rows = []
+        if ids:
+            # NOT INDEXED: claim by rowid; otherwise the planner walks every
+            # queued row through the status indexes
+            marks = ",".join("?" * len(ids))
+            if _HAS_RETURNING:
+                rows = conn.execute(
+                    "UPDATE tasks NOT INDEXED SET status='running', runner_id=?, lease_until=?, attempts=attempts+1 "
+                    f"WHERE status='queued' AND id IN ({marks}) RETURNING id, payload_json, task_type",
+                    [runner_id, lease_until, *ids],
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    f"SELECT id, payload_json, task_type FROM tasks NOT INDEXED WHERE status='queued' AND id IN ({marks})", ids,
+                ).fetchall()
+                conn.execute(
+                    "UPDATE tasks NOT INDEXED SET status='running', runner_id=?, lease_until=?, attempts=attempts+1 "
+                    f"WHERE status='queued' AND id IN ({marks})",
+                    [runner_id, lease_until, *ids],
+                )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    order = {tid: i for i, tid in enumerate(ids)}
+    rows.sort(key=lambda r: order[r[0]])
+    return [(int(tid), json.loads(payload_json), str(task_type)) for tid, payload_json, task_type in rows]
+
+def has_queued(task_types: Optional[List[str]] = None) -> bool:
+    # read-only probe used by long-polls before they take the write lock
+    where, args = "status='queued'", []
+    if task_types:
+        where += f" AND task_type IN ({','.join('?' * len(task_types))})"
+        args = list(task_types)
+    return _db().execute(f"SELECT 1 FROM tasks WHERE {where} LIMIT 1", args).fetchone() is not None
+
+def claim_next(runner_id: str, task_types: Optional[List[str]] = None) -> Optional[Tuple[int, Dict[str, Any], str]]:
+    got = claim_batch(runner_id, 1, task_types=task_types)
+    return got[0] if got else None
+
+def set_result(runner_id: str, tid: int, ok: bool, result: Dict[str, Any], error_text: str = "") -> bool:
+    applied, _ = set_results_bulk(runner_id, [{"task_id": tid, "ok": ok, "result": result, "error": error_text}])
+    return bool(applied)
+
+def set_results_bulk(runner_id: str, results: List[Dict[str, Any]]) -> Tuple[List[int], List[int]]:
+    # many results, one transaction; items: {task_id, ok, result, error}.
+    # Only tasks this runner still holds are updated: a result that arrives
+    # after the lease was reaped (and maybe re-claimed) is rejected.
+    # Returns (applied ids, rejected ids).
+    rows = []
+    for r in results:
+        tid = int(r.get("task_id") or 0)
+        if tid <= 0:
+            continue
+        rows.append((
+            "done" if r.get("ok") else "failed",
+            json.dumps(r.get("result"), ensure_ascii=True),
+            str(r.get("error") or ""),
+            tid,
+            runner_id,
+        ))
+    applied, rejected = [], []
+    if not rows:
+        return applied, rejected
     conn = _db()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM tasks ORDER BY id DESC LIMIT ?", (int(limit),))
-    ids = [r[0] for r in cur.fetchall()]
-    conn.close()
-    out = []
-    for tid in ids:
-        t = get_task(int(tid))
-        if t:
-            out.append(t)
-    return out
+    with conn:
+        for row in rows:
+            cur = conn.execute(
+                "UPDATE tasks SET status=?, result_json=?, error_text=?, lease_until=NULL "
+                "WHERE id=? AND status='running' AND runner_id=?",
+                row,
+            )
+            (applied if cur.rowcount else rejected).append(row[3])
+    return applied, rejected
+
+def heartbeat(runner_id: str, task_ids: List[int], lease_sec: int = LEASE_SEC) -> List[int]:
+    # extend the leases this runner still owns; returns the ids it still holds
+    ids = [int(t) for t in task_ids if int(t) > 0]
+    if not ids:
+        return []
+    marks = ",".join("?" * len(ids))
+    conn = _db()
+    with conn:
+        conn.execute(
+            f"UPDATE tasks SET lease_until=? WHERE status='running' AND runner_id=? AND id IN ({marks})",
+            [_now() + int(lease_sec), runner_id, *ids],
+        )
+    rows = conn.execute(
+        f"SELECT id FROM tasks WHERE status='running' AND runner_id=? AND id IN ({marks})",
+        [runner_id, *ids],
+    ).fetchall()
+    return [r[0] for r in rows]
+
+def reap_expired(max_attempts: int = MAX_ATTEMPTS) -> Dict[str, int]:
+    # bulk re-queue expired leases; tasks out of attempts are failed instead
+    now = _now()
+    conn = _db()
+    with conn:
+        failed = conn.execute(
+            "UPDATE tasks SET status='failed', error_text='lease_expired', lease_until=NULL "
+            "WHERE status='running' AND lease_until < ? AND attempts >= ?",
+            (now, int(max_attempts)),
+        ).rowcount
+        requeued = conn.execute(
+            "UPDATE tasks SET status='queued', runner_id=NULL, lease_until=NULL "
+            "WHERE status='running' AND lease_until < ?",
+            (now,),
+        ).rowcount
+    return {"requeued": requeued, "failed": failed}
+
+def _maybe_reap() -> None:
+    global _LAST_REAP
+    t = time.time()
+    if t - _LAST_REAP < REAP_EVERY:
+        return
+    _LAST_REAP = t
+    reap_expired()
+
+def get_task(tid: int) -> Optional[Dict[str, Any]]:
+    row = _db().execute(f"SELECT {_COLS} FROM tasks WHERE id=?", (tid,)).fetchone()
+    return _row_to_task(row) if row else None
+
+def list_recent(limit: int = 25) -> List[Dict[str, Any]]:
+    rows = _db().execute(f"SELECT {_COLS} FROM tasks ORDER BY id DESC LIMIT ?", (int(limit),)).fetchall()
+    return [_row_to_task(r) for r in rows]
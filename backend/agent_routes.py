@@ -0,0 +1,203 @@
+import os, json, asyncio
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.requests import Request
+from starlette.routing import Route
+
+from .agent_queue import submit_task, claim_batch, has_queued, set_results_bulk, heartbeat, reap_expired, get_task, list_recent
+
+MAX_BATCH = 50
+MAX_WAIT = 60
+KEEPALIVE = 15
+# submits from other processes (CLI, other workers) do not wake us, so
+# long-polls still re-check the table this often
+RECHECK_SEC = 1.0
+
+# Long-poll waiters park on an asyncio.Event; submits handled by this server
+# set it and swap in a fresh one.
+_EVENT = None
+
+def _wake():
+    global _EVENT
+    ev, _EVENT = _EVENT, None
+    if ev is not None:
+        ev.set()
+
+async def _claim_wait(runner_id: str, n: int, types, wait: float):
+    global _EVENT
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while True:
+        # SQLite runs in a worker thread (busy_timeout can block for seconds),
+        # and the write transaction is only opened once a read finds work
+        got = []
+        if await asyncio.to_thread(has_queued, types):
+            got = await asyncio.to_thread(claim_batch, runner_id, n, task_types=types)
+        left = deadline - loop.time()
+        if got or left <= 0:
+            return got
+        if _EVENT is None:
+            _EVENT = asyncio.Event()
+        try:
+            await asyncio.wait_for(_EVENT.wait(), min(left, RECHECK_SEC))
+        except asyncio.TimeoutError:
+            pass
+
+def _edit_key_ok(request: Request) -> bool:
+    want = os.getenv("STATION_EDIT_KEY", "1234")
+    got = request.headers.get("x-edit-key", "")
+    return bool(got) and got == want
+
+def _runner_key_ok(request: Request) -> bool:
+    want = os.getenv("STATION_RUNNER_KEY", "runner-1234")
+    got = request.headers.get("x-runner-key", "")
+    return bool(got) and got == want
+
+def _ids(values):
+    # positive int ids, or None when any of them is not one
+    try:
+        ids = [int(v) for v in values]
+    except (TypeError, ValueError):
+        return None
+    return ids if all(i > 0 for i in ids) else None
+
+def _task_json(t):
+    tid, payload, task_type = t
+    return {"id": tid, "task_type": task_type, "payload": payload}
+
+async def agent_submit(request: Request):
+    if not _edit_key_ok(request):
+        return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+    try:
+        body = await request.json()
+    except Exception:
+        body = {}
+    task_type = (body.get("task_type") or "shell").strip()
+    payload = body.get("payload") or {}
+    try:
+        priority = int(body.get("priority") or 0)
+    except (TypeError, ValueError):
+        priority = 0
+    tid = await asyncio.to_thread(submit_task, task_type, payload, priority=priority)
+    _wake()
+    return JSONResponse({"ok": True, "task_id": tid, "priority": priority})
+
+def _next_params(request: Request):
+    q = request.query_params
+    runner_id = q.get("runner_id") or "termux"
+    try:
+        n = max(1, min(MAX_BATCH, int(q.get("n") or 1)))
+    except ValueError:
+        n = 1
+    try:
+        wait = max(0.0, min(MAX_WAIT, float(q.get("wait") or 0)))
+    except ValueError:
+        wait = 0.0
+    types = [t.strip() for t in (q.get("types") or "").split(",") if t.strip()]
+    return runner_id, n, types or None, wait
+
+async def agent_next(request: Request):
+    # ?n=K hands out up to K tasks in one round-trip ("tasks"); "task" keeps
+    # the first one for single-task runners. ?types=a,b limits the lanes served.
+    # ?wait=N long-polls up to N seconds instead of returning an empty batch.
+    if not _runner_key_ok(request):
+        return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+    runner_id, n, types, wait = _next_params(request)
+    got = [_task_json(t) for t in await _claim_wait(runner_id, n, types, wait)]
+    return JSONResponse({"ok": True, "task": got[0] if got else None, "tasks": got})
+
+async def agent_stream(request: Request):
+    # server-sent events: one "tasks" event per claimed batch, comments as
+    # keepalive. A task claimed as the client drops is recovered by its lease.
+    if not _runner_key_ok(request):
+        return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+    runner_id, n, types, _ = _next_params(request)
+
+    async def events():
+        while not await request.is_disconnected():
+            got = await _claim_wait(runner_id, n, types, KEEPALIVE)
+            if not got:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: tasks\ndata: {json.dumps([_task_json(t) for t in got])}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+async def agent_result(request: Request):
+    # {runner_id, task_id, ok, result, error} or {runner_id, "results": [...]};
+    # results for tasks the runner no longer holds come back in "rejected"
+    if not _runner_key_ok(request):
+        return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+    try:
+        body = await request.json()
+    except Exception:
+        body = {}
+    runner_id = str(body.get("runner_id") or "").strip()
+    if not runner_id:
+        return JSONResponse({"ok": False, "error": "missing_runner_id"}, status_code=400)
+    items = body.get("results") if isinstance(body.get("results"), list) else [body]
+    items = [r for r in items if isinstance(r, dict)]
+    if not items or any(r.get("task_id") in (None, "") for r in items):
+        return JSONResponse({"ok": False, "error": "missing_task_id"}, status_code=400)
+    ids = _ids(r["task_id"] for r in items)
+    if ids is None:
+        return JSONResponse({"ok": False, "error": "bad_task_id"}, status_code=400)
+    items = [{**r, "task_id": tid} for r, tid in zip(items, ids)]
+    applied, rejected = await asyncio.to_thread(set_results_bulk, runner_id, items)
+    return JSONResponse({"ok": True, "saved": len(applied), "applied": applied, "rejected": rejected})
+
+async def agent_heartbeat(request: Request):
+    # {runner_id, task_ids: [...], lease_sec?} -> ids whose lease was extended
+    if not _runner_key_ok(request):
+        return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+    try:
+        body = await request.json()
+    except Exception:
+        body = {}
+    runner_id = str(body.get("runner_id") or "termux")
+    raw = body.get("task_ids") or ([body["task_id"]] if body.get("task_id") else [])
+    ids = _ids(raw) if isinstance(raw, list) else None
+    if ids is None:
+        return JSONResponse({"ok": False, "error": "bad_task_id"}, status_code=400)
+    kw = {}
+    if body.get("lease_sec"):
+        try:
+            kw["lease_sec"] = int(body["lease_sec"])
+        except (TypeError, ValueError):
+            return JSONResponse({"ok": False, "error": "bad_lease_sec"}, status_code=400)
+    held = await asyncio.to_thread(heartbeat, runner_id, ids, **kw)
+    return JSONResponse({"ok": True, "held": held, "lost": [t for t in ids if t not in held]})
+
+async def agent_reap(request: Request):
+    if not _edit_key_ok(request):
+        return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+    res = await asyncio.to_thread(reap_expired)
+    if res["requeued"]:
+        _wake()
+    return JSONResponse({"ok": True, **res})
+
+async def agent_task_get(request: Request):
+    if not _edit_key_ok(request):
+        return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+    tid = int(request.path_params.get("tid") or 0)
+    return JSONResponse({"ok": True, "task": await asyncio.to_thread(get_task, tid)})
+
+async def agent_recent(request: Request):
+    if not _edit_key_ok(request):
+        return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+    try:
+        lim = int(request.query_params.get("limit") or 25)
+    except ValueError:
+        lim = 25
+    return JSONResponse({"ok": True, "items": await asyncio.to_thread(list_recent, lim)})
+
+def routes():
+    return [
+        Route("/agent/tasks/submit", agent_submit, methods=["POST"]),
+        Route("/agent/tasks/next", agent_next, methods=["GET"]),
+        Route("/agent/tasks/stream", agent_stream, methods=["GET"]),
+        Route("/agent/tasks/result", agent_result, methods=["POST"]),
+        Route("/agent/tasks/heartbeat", agent_heartbeat, methods=["POST"]),
+        Route("/agent/tasks/reap", agent_reap, methods=["POST"]),
+        Route("/agent/tasks/recent", agent_recent, methods=["GET"]),
+        Route("/agent/tasks/{tid:int}", agent_task_get, methods=["GET"]),
+    ]
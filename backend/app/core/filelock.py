@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import fcntl
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Kernel-backed named locks shared by the backend and the ops scripts.
+# A lock is an exclusive flock(2) on a lock file: the kernel grants it to one
+# open file at a time, wakes a blocked waiter the moment it is released, and
+# drops it when the holder's process dies, so there is no stale-lock recovery
+# and no way for two owners to hold it at once. The file body carries lease
+# metadata (owner, pid, acquired_at, lease_seconds) for status pages and
+# LOCK_BUSY messages; the lease is advisory and is never used to steal a lock.
+# Lock files are truncated, not unlinked, on release; acquire re-checks the
+# inode so a file removed by a cleaner is never locked twice.
+# Semaphore builds a cross-process counting semaphore from a pool of them.
+
+class LockBusy(RuntimeError):
+    pass
+
+class LockOwnerMismatch(RuntimeError):
+    pass
+
+_HELD: Dict[str, "FileLock"] = {}
+_HELD_LOCK = threading.Lock()
+
+def read_meta(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.loads(f.read() or "{}")
+    except (OSError, ValueError):
+        return {}
+
+class _Waiter:
+    # the one helper thread for a lock path in this process: it blocks in
+    # flock(2) on its own fd and, once it has the lock, parks it (ready) until
+    # an acquirer takes the fd. flock cannot be cancelled, so an acquirer that
+    # times out leaves the waiter registered and the next acquire reuses it;
+    # if it gets through with nobody left wanting it, it drops the lock at once.
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.wanted = 0
+        self.ready = False
+        threading.Thread(target=self._run, name="filelock-wait", daemon=True).start()
+
+    def _run(self) -> None:
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            ok = True
+        except OSError:
+            ok = False
+        with _WAIT_CV:
+            if ok and self.wanted > 0 and _WAITERS.get(self.path) is self:
+                self.ready = True
+                _WAIT_CV.notify_all()
+                return
+            if _WAITERS.get(self.path) is self:
+                del _WAITERS[self.path]
+        os.close(self.fd)
+
+_WAITERS: Dict[str, _Waiter] = {}
+_WAIT_CV = threading.Condition()
+
+def _waiter(path: str) -> _Waiter:
+    # caller holds _WAIT_CV
+    w = _WAITERS.get(path)
+    if w is not None and not w.ready and not _same_file(w.fd, path):
+        # file was replaced; the old waiter closes its fd when it gets through
+        del _WAITERS[path]
+        w = None
+    if w is None:
+        w = _WAITERS[path] = _Waiter(path)
+    return w
+
+def _wait_any(paths: List[str], timeout: Optional[float]) -> Tuple[int, Optional[int]]:
+    # (index, locked fd) of the first path we get, or (-1, None) on timeout
+    # (None waits forever, 0 only tries). The caller owns the returned fd.
+    for i, path in enumerate(paths):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        return i, fd
+    if timeout is not None and timeout <= 0:
+        return -1, None
+    deadline = None if timeout is None else time.monotonic() + timeout
+    joined: Dict[int, _Waiter] = {}
+    with _WAIT_CV:
+        try:
+            while True:
+                for i, path in enumerate(paths):
+                    w = _waiter(path)
+                    if w.ready:
+                        del _WAITERS[path]
+                        return i, w.fd
+                    if joined.get(i) is not w:
+                        joined[i] = w
+                        w.wanted += 1
+                left = None if deadline is None else deadline - time.monotonic()
+                if left is not None and left <= 0:
+                    return -1, None
+                _WAIT_CV.wait(left)
+        finally:
+            # several slots can come ready for one acquirer; the ones it did
+            # not take would sit locked with no owner, so give them back
+            for w in joined.values():
+                w.wanted -= 1
+                if w.ready and w.wanted <= 0 and _WAITERS.get(w.path) is w:
+                    del _WAITERS[w.path]
+                    os.close(w.fd)
+
+def _same_file(fd: int, path: str) -> bool:
+    try:
+        return os.fstat(fd).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+class FileLock:
+    def __init__(self, path: str, name: Optional[str] = None):
+        self.path = os.path.abspath(path)
+        self.name = name or os.path.basename(path).split(".")[0]
+        self.owner = ""
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, owner: str = "", lease_seconds: float = 0, timeout: Optional[float] = 0) -> bool:
+        # timeout: seconds to wait for the holder, None forever, 0 try once
+        if self._fd is not None:
+            raise RuntimeError(f"LOCK_REENTRY:{self.name}")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            left = None if deadline is None else max(0.0, deadline - time.monotonic())
+            fd = _wait_any([self.path], left)[1]
+            if fd is None:
+                return False
+            if _same_file(fd, self.path):
+                break
+            os.close(fd)  # unlinked while we waited; lock the new file
+        self._take(fd, owner, lease_seconds)
+        return True
+
+    def _take(self, fd: int, owner: str, lease_seconds: float) -> None:
+        meta = {"name": self.name, "owner": owner, "pid": os.getpid(),
+                "acquired_at": int(time.time()), "lease_seconds": lease_seconds}
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, json.dumps(meta, ensure_ascii=False).encode("utf-8"), 0)
+        self._fd, self.owner = fd, owner
+        with _HELD_LOCK:
+            _HELD[self.path] = self
+
+    def release(self, owner: Optional[str] = None) -> None:
+        if self._fd is None:
+            return
+        if owner is not None and owner != self.owner:
+            raise LockOwnerMismatch(f"LOCK_OWNER_MISMATCH:{self.name}")
+        fd, self._fd = self._fd, None
+        with _HELD_LOCK:
+            if _HELD.get(self.path) is self:
+                del _HELD[self.path]
+        try:
+            os.ftruncate(fd, 0)
+        finally:
+            os.close(fd)  # closing drops the flock
+
+    def __enter__(self) -> "FileLock":
+        if not self.acquire(timeout=None):
+            raise LockBusy(f"LOCK_BUSY:{self.name}")
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+def acquire(path: str, owner: str, lease_seconds: float = 0, timeout: Optional[float] = 0,
+            name: Optional[str] = None) -> FileLock:
+    # raises LockBusy (message LOCK_BUSY:<name>:owned_by=<owner>) when not acquired in time
+    lk = FileLock(path, name)
+    if not lk.acquire(owner, lease_seconds, timeout):
+        raise LockBusy(f"LOCK_BUSY:{lk.name}:owned_by={read_meta(lk.path).get('owner')}")
+    return lk
+
+def release(path: str, owner: Optional[str] = None) -> None:
+    # releases the lock this process holds on path; owner=None skips the check
+    with _HELD_LOCK:
+        lk = _HELD.get(os.path.abspath(path))
+    if lk is not None:
+        lk.release(owner)
+
+def holder(path: str) -> Optional[dict]:
+    # lease metadata of the current holder, or None when the lock is free
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return read_meta(path)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        return None
+    finally:
+        os.close(fd)
+
+class Semaphore:
+    # counting semaphore across processes: a pool of `slots` lock files
+    # (<name>.slot<i>.lock); holding any one of them is holding a permit.
+    # A waiter blocks on every slot at once and wakes when the first frees;
+    # it shares the per-slot flock waiters, so timeouts cost no extra threads.
+    # A holder that dies gives its slot back with its process.
+    def __init__(self, lock_dir: str, name: str, slots: int):
+        self.name = name
+        self.slots = max(1, int(slots))
+        self.paths = [os.path.join(lock_dir, f"{name}.slot{i}.lock") for i in range(self.slots)]
+
+    def acquire(self, owner: str = "", lease_seconds: float = 0, timeout: Optional[float] = None) -> Optional[FileLock]:
+        # the slot lock (release it, or call release(owner)), or None on timeout
+        os.makedirs(os.path.dirname(self.paths[0]), exist_ok=True)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # start at a per-process offset so callers do not all pile onto slot 0
+        order = [(os.getpid() + i) % self.slots for i in range(self.slots)]
+        paths = [self.paths[i] for i in order]
+        while True:
+            left = None if deadline is None else max(0.0, deadline - time.monotonic())
+            won, fd = _wait_any(paths, left)
+            if fd is None:
+                return None
+            path = paths[won]
+            if _same_file(fd, path):
+                lk = FileLock(path, f"{self.name}.slot{order[won]}")
+                lk._take(fd, owner, lease_seconds)
+                return lk
+            os.close(fd)
+
+    def release(self, owner: Optional[str] = None) -> None:
+        # frees the slot this process holds for owner (any slot when owner is None)
+        with _HELD_LOCK:
+            held = [lk for p, lk in _HELD.items() if p in self.paths and owner in (None, lk.owner)]
+        if held:
+            held[0].release()
+
+    def holders(self) -> List[dict]:
+        return [m for m in (holder(p) for p in self.paths) if m is not None]
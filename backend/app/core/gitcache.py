@@ -0,0 +1,115 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
+
+from . import procs
+
+# Cached answers for read-only git commands (status, log, remote, ...).
+# An entry is keyed by (repo root, argv) and stays valid while the repo's
+# fingerprint -- stat of HEAD, the current branch ref and its upstream, index,
+# packed-refs, config and the refs directories -- is unchanged. Worktree edits
+# do not touch .git until something re-reads the index, so status-style
+# commands also take a short max age (STATUS_TTL).
+# Concurrent misses share one in-flight process. git is exec'd directly with
+# argv (no login shell), which is where nearly all the old cost was.
+
+STATUS_TTL = float(os.getenv("STATION_GIT_STATUS_TTL", "2.0"))
+GIT_TIMEOUT = 30
+
+_CACHE: Dict[Tuple[str, Tuple[str, ...]], Tuple[tuple, float, Future]] = {}
+_LOCK = threading.Lock()
+
+def git_dir(root: str) -> str:
+    g = os.path.join(root, ".git")
+    if os.path.isfile(g):
+        # worktrees and submodules: ".git" is a "gitdir: <path>" file
+        try:
+            with open(g, "r", encoding="utf-8") as f:
+                line = f.read().strip()
+            if line.startswith("gitdir:"):
+                return os.path.normpath(os.path.join(root, line[7:].strip()))
+        except OSError:
+            pass
+    return g
+
+def _stat(path: str):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+    except OSError:
+        return None
+
+def fingerprint(root: str) -> tuple:
+    g = git_dir(root)
+    fp = [_stat(os.path.join(g, p)) for p in
+          ("HEAD", "index", "packed-refs", "config", "refs/heads", "refs/tags", "refs/remotes")]
+    try:
+        with open(os.path.join(g, "HEAD"), "r", encoding="utf-8") as f:
+            head = f.read().strip()
+    except OSError:
+        head = ""
+    fp.append(head)
+    if head.startswith("ref: refs/heads/"):
+        branch = head[16:]
+        fp.append(_stat(os.path.join(g, "refs", "heads", branch)))
+        fp.append(_stat(os.path.join(g, "refs", "remotes", "origin", branch)))
+    return tuple(fp)
+
+def _entry(root: str, args: Tuple[str, ...], ttl: Optional[float]) -> Future:
+    key = (root, args)
+    fp = fingerprint(root)
+    now = time.monotonic()
+    with _LOCK:
+        hit = _CACHE.get(key)
+        if hit is not None:
+            hfp, at, fut = hit
+            fresh = ttl is None or now - at < ttl
+            if hfp == fp and fresh and not (fut.done() and fut.exception() is not None):
+                return fut
+        fut = _spawn(root, args)
+        _CACHE[key] = (fp, now, fut)
+        return fut
+
+def _spawn(root: str, args: Tuple[str, ...]) -> Future:
+    return procs.submit(["git", *args], cwd=root, timeout=GIT_TIMEOUT)
+
+async def git(root: str, *args: str, ttl: Optional[float] = None) -> procs.Result:
+    # ttl=None: valid until the fingerprint changes
+    return await asyncio.wrap_future(_entry(root, args, ttl))
+
+def git_sync(root: str, *args: str, ttl: Optional[float] = None) -> procs.Result:
+    return _entry(root, args, ttl).result()
+
+def _status_fut(root: str, branch: bool) -> Future:
+    args = ("status", "--porcelain", "-b") if branch else ("status", "--porcelain")
+    return _entry(root, args, STATUS_TTL)
+
+def _log_fut(root: str, n: int) -> Future:
+    return _entry(root, ("log", "--oneline", "-n", str(int(n))), None)
+
+def _remote_fut(root: str) -> Future:
+    return _entry(root, ("remote", "-v"), None)
+
+async def status(root: str, branch: bool = False) -> procs.Result:
+    # `git status --porcelain [-b]`
+    return await asyncio.wrap_future(_status_fut(root, branch))
+
+def status_sync(root: str, branch: bool = False) -> procs.Result:
+    return _status_fut(root, branch).result()
+
+async def log(root: str, n: int = 5) -> procs.Result:
+    # `git log --oneline -n N`
+    return await asyncio.wrap_future(_log_fut(root, n))
+
+async def remote(root: str) -> procs.Result:
+    # `git remote -v`
+    return await asyncio.wrap_future(_remote_fut(root))
+
+def invalidate(root: Optional[str] = None) -> None:
+    # after a command that changes the repo, e.g. a push
+    with _LOCK:
+        for key in [k for k in _CACHE if root is None or k[0] == root]:
+            del _CACHE[key]
@@ -0,0 +1,208 @@
+import os
+import json
+import signal
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+# Shared subprocess engine.
+# Every child process is spawned and read on one background asyncio loop, so
+# request handlers await a future instead of blocking the server loop, sync
+# callers (factory rooms, doctor) block only their own thread, and a single
+# semaphore bounds how many children run at once across the whole process.
+
+MAX_CONCURRENCY = int(os.getenv("STATION_PROC_CONCURRENCY", "4"))
+DEFAULT_TIMEOUT = 120.0
+OUT_CAP = 64_000  # characters kept per stream (the tail)
+STREAM_BUFFER = 256  # line batches a stream() consumer may fall behind by
+_CHUNK = 8192
+
+Cmd = Union[str, Sequence[str]]
+# (stream name, complete lines); awaited on the engine loop, so a slow
+# consumer stops the pipe from being read and the child blocks on write
+LineFn = Callable[[str, List[str]], Awaitable[None]]
+
+@dataclass
+class Result:
+    rc: int
+    stdout: str
+    stderr: str
+    timed_out: bool = False
+    truncated: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.rc == 0 and not self.timed_out
+
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_SEM: Optional[asyncio.Semaphore] = None
+_INIT_LOCK = threading.Lock()
+
+def _loop() -> asyncio.AbstractEventLoop:
+    global _LOOP, _SEM
+    with _INIT_LOCK:
+        if _LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="procs", daemon=True).start()
+            _SEM = asyncio.Semaphore(max(1, MAX_CONCURRENCY))
+            _LOOP = loop
+        return _LOOP
+
+class _Tail:
+    def __init__(self, cap: int):
+        self.cap = cap
+        self.parts: List[str] = []
+        self.size = 0
+        self.truncated = False
+        self.partial = ""
+
+    def feed(self, text: str, split: bool) -> List[str]:
+        # keeps the tail; returns the lines completed by `text` when splitting
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size > 2 * self.cap:
+            joined = "".join(self.parts)[-self.cap:]
+            self.parts, self.size, self.truncated = [joined], len(joined), True
+        if not split:
+            return []
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+        return lines
+
+    def text(self) -> str:
+        out = "".join(self.parts)
+        if len(out) > self.cap:
+            out, self.truncated = out[-self.cap:], True
+        return out
+
+async def _pump(reader: asyncio.StreamReader, tail: _Tail, name: str, on_line: Optional[LineFn]) -> None:
+    while True:
+        chunk = await reader.read(_CHUNK)
+        if not chunk:
+            break
+        lines = tail.feed(chunk.decode("utf-8", "replace"), on_line is not None)
+        if lines:
+            await on_line(name, lines)
+    if on_line is not None and tail.partial:
+        await on_line(name, [tail.partial])
+
+def _kill(p: asyncio.subprocess.Process) -> None:
+    # children run in their own session, so shells take their pipelines down too
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except Exception:
+        try:
+            p.kill()
+        except Exception:
+            pass
+
+async def _run(cmd: Cmd, cwd: Optional[str], env: Optional[Dict[str, str]], timeout: Optional[float],
+               merge_stderr: bool, out_cap: int, on_line: Optional[LineFn]) -> Result:
+    assert _SEM is not None
+    async with _SEM:
+        err_to = asyncio.subprocess.STDOUT if merge_stderr else asyncio.subprocess.PIPE
+        kw = dict(cwd=cwd, env=env, stdin=asyncio.subprocess.DEVNULL,
+                  stdout=asyncio.subprocess.PIPE, stderr=err_to, start_new_session=True)
+        try:
+            if isinstance(cmd, str):
+                p = await asyncio.create_subprocess_shell(cmd, **kw)
+            else:
+                p = await asyncio.create_subprocess_exec(*cmd, **kw)
+        except (OSError, ValueError) as e:
+            return Result(rc=-1, stdout="", stderr=str(e))
+        out, err = _Tail(out_cap), _Tail(out_cap)
+        pumps = [_pump(p.stdout, out, "stdout", on_line)]
+        if not merge_stderr:
+            pumps.append(_pump(p.stderr, err, "stderr", on_line))
+        timed_out = False
+        work = asyncio.gather(*pumps, p.wait())
+        try:
+            await asyncio.wait_for(work, timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            _kill(p)
+            await p.wait()
+        except asyncio.CancelledError:
+            # caller went away (client disconnect): kill, collect the pumps'
+            # outcome so nothing is left unretrieved, and reap the child
+            _kill(p)
+            work.cancel()
+            await asyncio.gather(work, return_exceptions=True)
+            await p.wait()
+            raise
+        stderr = err.text()
+        if timed_out:
+            stderr = (stderr + "\n" if stderr else "") + f"timeout after {timeout}s"
+        return Result(
+            rc=p.returncode if p.returncode is not None else -1,
+            stdout=out.text(),
+            stderr=stderr,
+            timed_out=timed_out,
+            truncated=out.truncated or err.truncated,
+        )
+
+def submit(cmd: Cmd, cwd=None, env=None, timeout=DEFAULT_TIMEOUT, merge_stderr=False, out_cap=OUT_CAP, on_line=None):
+    # start the command; returns a concurrent.futures.Future of its Result
+    coro = _run(cmd, cwd, env, timeout, merge_stderr, out_cap, on_line)
+    return asyncio.run_coroutine_threadsafe(coro, _loop())
+
+async def run(cmd: Cmd, cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None,
+              timeout: Optional[float] = DEFAULT_TIMEOUT, merge_stderr: bool = False,
+              out_cap: int = OUT_CAP, on_line: Optional[LineFn] = None) -> Result:
+    # a str cmd runs through the shell, a sequence is exec'd directly
+    return await asyncio.wrap_future(submit(cmd, cwd, env, timeout, merge_stderr, out_cap, on_line))
+
+def run_sync(cmd: Cmd, cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None,
+             timeout: Optional[float] = DEFAULT_TIMEOUT, merge_stderr: bool = False,
+             out_cap: int = OUT_CAP) -> Result:
+    # for plain threads; never call this from a coroutine
+    return submit(cmd, cwd, env, timeout, merge_stderr, out_cap).result()
+
+async def stream(cmd: Cmd, cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None,
+                 timeout: Optional[float] = DEFAULT_TIMEOUT, merge_stderr: bool = False,
+                 out_cap: int = OUT_CAP) -> AsyncIterator[Tuple[str, Union[str, Result]]]:
+    # yields ("stdout"|"stderr", line) as the child writes, then ("exit", Result).
+    # At most STREAM_BUFFER batches are queued; past that the child is paused.
+    loop = asyncio.get_running_loop()
+    q: asyncio.Queue = asyncio.Queue(maxsize=STREAM_BUFFER)
+
+    async def on_line(name: str, lines: List[str]) -> None:
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(q.put((name, lines)), loop))
+
+    fut = asyncio.wrap_future(submit(cmd, cwd, env, timeout, merge_stderr, out_cap, on_line))
+    getter = None
+    try:
+        while True:
+            getter = asyncio.ensure_future(q.get())
+            await asyncio.wait([getter, fut], return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                break
+            name, lines = getter.result()
+            for line in lines:
+                yield name, line.rstrip("\r")
+        while not q.empty():
+            name, lines = q.get_nowait()
+            for line in lines:
+                yield name, line.rstrip("\r")
+        yield ("exit", await fut)
+    finally:
+        if getter is not None and not getter.done():
+            getter.cancel()
+        if not fut.done():
+            fut.cancel()
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def sse(cmd: Cmd, on_exit: Optional[Callable[[Result], dict]] = None, **kw) -> AsyncIterator[str]:
+    # stream() framed as server-sent events: "stdout"/"stderr" events carry
+    # {"line"}, the final "exit" event carries rc/ok plus on_exit(result)
+    async for name, item in stream(cmd, **kw):
+        if name != "exit":
+            yield _sse(name, {"line": item})
+            continue
+        data = {"rc": item.rc, "ok": item.ok, "timed_out": item.timed_out}
+        if on_exit is not None:
+            data.update(on_exit(item) or {})
+        yield _sse("exit", data)
@@ -1,6 +1,8 @@
 import time
 from collections import defaultdict
 from starlette.requests import Request
+from starlette.responses import StreamingResponse
+from starlette.background import BackgroundTask
 
 # simple in-memory rate limit (per IP)
 _BUCKET = defaultdict(list)
@@ -17,6 +19,27 @@ def rate_limit_ok(request: Request) -> bool:
     q.append(now)
     return True
 
+def _hold_until_sent(res: StreamingResponse, release) -> StreamingResponse:
+    # keep the room for the whole stream: released after the last chunk, or
+    # by the background hook when the client disconnects first
+    body, after = res.body_iterator, res.background
+
+    async def iterate():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            release()
+
+    async def background():
+        release()
+        if after is not None:
+            await after()
+
+    res.body_iterator = iterate()
+    res.background = BackgroundTask(background)
+    return res
+
 def require_room(room: str):
     from app.rooms import acquire_room, release_room
     def decorator(fn):
@@ -25,9 +48,21 @@ def require_room(room: str):
                 return {"ok": False, "error": "rate_limited"}
             if not acquire_room(room):
                 return {"ok": False, "error": "room_busy", "room": room}
+            held = [True]
+
+            def release():
+                if held[0]:
+                    held[0] = False
+                    release_room(room)
+
             try:
-                return await fn(request, *a, **kw)
-            finally:
-                release_room(room)
+                res = await fn(request, *a, **kw)
+            except BaseException:
+                release()
+                raise
+            if isinstance(res, StreamingResponse):
+                return _hold_until_sent(res, release)
+            release()
+            return res
         return wrapper
     return decorator
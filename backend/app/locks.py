@@ -1,32 +1,26 @@
-import time, os
+import os
 from pathlib import Path
+from app.core import filelock
 
 ROOT = Path(__file__).resolve().parents[2]
 LOCK_DIR = ROOT / "station_meta" / "locks"
 LOCK_DIR.mkdir(parents=True, exist_ok=True)
 
 class GlobalLock:
+    # non-blocking room lock on a kernel flock; ttl is recorded as the lease
     def __init__(self, name: str, ttl: float = 10.0):
         self.path = LOCK_DIR / f"{name}.lock"
         self.ttl = float(ttl)
+        self._lock = filelock.FileLock(str(self.path), name)
 
     def acquire(self) -> bool:
-        now = time.time()
-        if self.path.exists():
-            try:
-                ts = float(self.path.read_text().strip() or 0)
-                if now - ts < self.ttl:
-                    return False
-            except Exception:
-                pass
         try:
-            self.path.write_text(str(now))
-            return True
-        except Exception:
+            return self._lock.acquire(f"pid:{os.getpid()}", self.ttl, timeout=0)
+        except (OSError, RuntimeError):
             return False
 
     def release(self):
         try:
-            self.path.unlink(missing_ok=True)
+            self._lock.release()
         except Exception:
             pass
@@ -0,0 +1,118 @@
+import os, asyncio, subprocess, threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+# Task-kind executor registry for the loop worker.
+# Every kind declares how it runs and how many may run at once:
+#   inline      plain call on the worker thread (cheap kinds)
+#   process     shared process pool, for CPU-bound kinds (fn must be picklable)
+#   io          coroutine on a shared asyncio loop thread, for I/O-bound kinds
+#   subprocess  fn(payload) returns argv (or {"cmd", "cwd", "timeout"}); we run it
+# Workers reserve a slot before claiming, so a saturated slow kind is skipped
+# and cheap kinds keep flowing. submit() only runs inline kinds on the caller;
+# the rest hand back a Future so the worker can move on while they run.
+
+MODES = ("inline", "process", "io", "subprocess")
+OUT_TAIL = 4000
+
+class KindSpec:
+  def __init__(self, kind: str, fn, mode: str, limit: int):
+    if mode not in MODES:
+      raise ValueError(f"unknown executor mode: {mode}")
+    self.kind = kind
+    self.fn = fn
+    self.mode = mode
+    self.limit = max(1, int(limit))
+    self.slots = threading.BoundedSemaphore(self.limit)
+
+_REGISTRY: dict[str, KindSpec] = {}
+_POOL = None
+_IO_LOOP = None
+_SUB_POOL = None
+_INIT_LOCK = threading.Lock()
+
+def register(kind: str, fn, mode: str = "inline", limit: int = 4):
+  _REGISTRY[kind] = KindSpec(kind, fn, mode, limit)
+
+def task_kind(kind: str, mode: str = "inline", limit: int = 4):
+  def decorator(fn):
+    register(kind, fn, mode=mode, limit=limit)
+    return fn
+  return decorator
+
+def spec(kind: str) -> KindSpec|None:
+  return _REGISTRY.get(kind)
+
+def kinds() -> dict:
+  return {k: {"mode": s.mode, "limit": s.limit} for k, s in _REGISTRY.items()}
+
+def try_reserve(kind: str) -> bool:
+  # unknown kinds need no slot; run() reports them as errors
+  s = _REGISTRY.get(kind)
+  return True if s is None else s.slots.acquire(blocking=False)
+
+def release(kind: str):
+  s = _REGISTRY.get(kind)
+  if s is not None:
+    try:
+      s.slots.release()
+    except ValueError:
+      pass
+
+def _process_pool() -> ProcessPoolExecutor:
+  global _POOL
+  with _INIT_LOCK:
+    if _POOL is None:
+      _POOL = ProcessPoolExecutor(max_workers=os.cpu_count() or 2)
+    return _POOL
+
+def _io_loop() -> asyncio.AbstractEventLoop:
+  global _IO_LOOP
+  with _INIT_LOCK:
+    if _IO_LOOP is None:
+      loop = asyncio.new_event_loop()
+      threading.Thread(target=loop.run_forever, name="loop-io", daemon=True).start()
+      _IO_LOOP = loop
+    return _IO_LOOP
+
+def _subprocess_pool() -> ThreadPoolExecutor:
+  # threads only wait on children; the kind slots bound how many run
+  global _SUB_POOL
+  with _INIT_LOCK:
+    if _SUB_POOL is None:
+      _SUB_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="loop-sub")
+    return _SUB_POOL
+
+def _run_subprocess(spec_out) -> dict:
+  if isinstance(spec_out, dict):
+    cmd, cwd, timeout = spec_out.get("cmd"), spec_out.get("cwd"), spec_out.get("timeout", 120)
+  else:
+    cmd, cwd, timeout = spec_out, None, 120
+  try:
+    p = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, timeout=timeout)
+  except subprocess.TimeoutExpired:
+    return {"ok": False, "error": "timeout", "cmd": cmd}
+  return {
+    "ok": p.returncode == 0,
+    "rc": p.returncode,
+    "stdout": (p.stdout or "")[-OUT_TAIL:],
+    "stderr": (p.stderr or "")[-OUT_TAIL:],
+  }
+
+def submit(kind: str, payload: dict) -> dict|Future:
+  # inline kinds run here and return their result; other modes return a
+  # Future resolving to it, so the caller is not held for the run
+  s = _REGISTRY.get(kind)
+  if s is None:
+    return {"ok": False, "error": "unknown_task_kind", "kind": kind, "payload": payload}
+  if s.mode == "inline":
+    return s.fn(payload)
+  if s.mode == "process":
+    return _process_pool().submit(s.fn, payload)
+  if s.mode == "io":
+    return asyncio.run_coroutine_threadsafe(s.fn(payload), _io_loop())
+  return _subprocess_pool().submit(_run_subprocess, s.fn(payload))
+
+def run(kind: str, payload: dict) -> dict:
+  # blocks the caller until the kind's executor returns
+  out = submit(kind, payload)
+  return out.result() if isinstance(out, Future) else out
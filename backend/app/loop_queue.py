@@ -1,10 +1,15 @@
-import json, time, os, uuid
+import time, os, uuid
 from pathlib import Path
 
+from app.loop_store import TaskLog
+from app import loop_wakeup
+
 ROOT_DIR = Path(__file__).resolve().parents[2]
 QUEUE_DIR = ROOT_DIR / "station_meta" / "queue"
 TASKS_JL = QUEUE_DIR / "tasks.jsonl"
+TASKS_IDX = QUEUE_DIR / "tasks.idx.json"
 LOCK_DIR = QUEUE_DIR / "locks"
+WAKE_DIR = QUEUE_DIR / "wake"
 LOG_DIR  = ROOT_DIR / "station_meta" / "logs"
 
 def _ensure():
@@ -17,10 +22,11 @@ def _ensure():
 def now() -> float:
   return time.time()
 
+_STORE = TaskLog(TASKS_JL, TASKS_IDX)
+
 def _append(rec: dict):
   _ensure()
-  with TASKS_JL.open("a", encoding="utf-8") as f:
-    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+  _STORE.append(rec)
 
 def submit(kind: str, payload: dict, max_retries: int = 3) -> dict:
   tid = str(uuid.uuid4())
@@ -33,24 +39,47 @@ def submit(kind: str, payload: dict, max_retries: int = 3) -> dict:
     "updated_at": now(),
     "tries": 0,
     "max_retries": int(max_retries),
+    "not_before": 0.0,
     "last_error": ""
   }
   _append(rec)
+  loop_wakeup.notify(WAKE_DIR)
   return rec
 
+def listen_wakeups() -> bool:
+  return loop_wakeup.listen(WAKE_DIR)
+
 def list_tail(limit: int = 200) -> list[dict]:
+  # latest state of the last `limit` tasks, read from the end of the log
   _ensure()
   try:
-    lines = TASKS_JL.read_text(encoding="utf-8").splitlines()
+    return _STORE.tail(limit)
   except Exception:
     return []
-  out = []
-  for ln in lines[-limit:]:
-    try:
-      out.append(json.loads(ln))
-    except Exception:
-      pass
-  return out
+
+def get_task(tid: str) -> dict|None:
+  _ensure()
+  return _STORE.get(tid)
+
+def update_task(tid: str, **changes) -> dict|None:
+  # appends a status transition; history is never rewritten
+  _ensure()
+  changes.setdefault("updated_at", now())
+  return _STORE.update(tid, **changes)
+
+def open_tasks() -> list[tuple[str, str, str]]:
+  # (id, status, kind) of pending / retryable tasks that are due, oldest first
+  _ensure()
+  return _STORE.open_ids()
+
+def next_due() -> float|None:
+  # earliest not_before among delayed retries
+  _ensure()
+  return _STORE.next_due()
+
+def checkpoint():
+  _ensure()
+  _STORE.checkpoint()
 
 def _lock_path(tid: str) -> Path:
   return LOCK_DIR / f"{tid}.lock"
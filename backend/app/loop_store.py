@@ -0,0 +1,241 @@
+import json, os, time, heapq, threading, fcntl
+from pathlib import Path
+
+# Append-only task log.
+# Every status transition appends a full record; the newest line for an id wins.
+# An id->offset index (kept in memory, checkpointed to disk, rebuildable from the log)
+# lets get/update seek straight to a task instead of re-reading the whole file.
+# Retried tasks carry a `not_before` timestamp; until then they wait in a
+# min-heap delay queue and are not handed out.
+
+CHECKPOINT_BYTES = 256 * 1024
+INDEX_VERSION = 2
+TAIL_CHUNK = 64 * 1024
+
+def is_open(rec: dict) -> bool:
+  # pending, or failed with retries left
+  st = rec.get("status")
+  if st == "pending":
+    return True
+  if st == "failed":
+    return int(rec.get("tries", 0)) < int(rec.get("max_retries", 0))
+  return False
+
+class TaskLog:
+  def __init__(self, path: Path, index_path: Path):
+    self.path = Path(path)
+    self.index_path = Path(index_path)
+    self._lock = threading.RLock()
+    self._reset()
+
+  def _reset(self):
+    self._offsets: dict[str, int] = {}
+    self._open: dict[str, tuple[str, str]] = {}   # ready: id -> (status, kind), in log order
+    self._waiting: dict[str, tuple[float, str, str]] = {}   # id -> (not_before, status, kind)
+    self._heap: list[tuple[float, str]] = []
+    self._size = 0
+    self._ino = None
+    self._dirty = 0
+    self._loaded = False
+
+  # ---------- index ----------
+
+  def _load_index(self, st: os.stat_result):
+    try:
+      idx = json.loads(self.index_path.read_text(encoding="utf-8"))
+    except Exception:
+      return
+    if idx.get("v") != INDEX_VERSION or idx.get("ino") != st.st_ino or int(idx.get("size", 0)) > st.st_size:
+      return
+    self._offsets = {k: int(v) for k, v in (idx.get("offsets") or {}).items()}
+    self._open = {k: (v[0], v[1]) for k, v in (idx.get("open") or {}).items()}
+    self._waiting = {k: (float(v[0]), v[1], v[2]) for k, v in (idx.get("waiting") or {}).items()}
+    self._heap = [(w[0], tid) for tid, w in self._waiting.items()]
+    heapq.heapify(self._heap)
+    self._size = int(idx.get("size", 0))
+
+  def _write_index(self):
+    idx = {"v": INDEX_VERSION, "ino": self._ino, "size": self._size, "offsets": self._offsets,
+           "open": self._open, "waiting": self._waiting}
+    tmp = self.index_path.with_suffix(".tmp")
+    try:
+      tmp.write_text(json.dumps(idx), encoding="utf-8")
+      os.replace(tmp, self.index_path)
+      self._dirty = 0
+    except Exception:
+      pass
+
+  def checkpoint(self):
+    with self._lock:
+      self.refresh()
+      self._write_index()
+
+  def _fold(self, rec: dict, off: int):
+    tid = rec.get("id")
+    if not tid:
+      return
+    self._offsets[tid] = off
+    self._open.pop(tid, None)
+    self._waiting.pop(tid, None)
+    if not is_open(rec):
+      return
+    nb = float(rec.get("not_before") or 0)
+    kind = (rec.get("kind") or "").strip()
+    if nb > time.time():
+      self._waiting[tid] = (nb, rec.get("status"), kind)
+      heapq.heappush(self._heap, (nb, tid))
+    else:
+      self._open[tid] = (rec.get("status"), kind)
+
+  def _promote(self):
+    # move due entries from the delay heap to the ready set; skip stale ones
+    now = time.time()
+    while self._heap and self._heap[0][0] <= now:
+      nb, tid = heapq.heappop(self._heap)
+      w = self._waiting.get(tid)
+      if w and w[0] == nb:
+        del self._waiting[tid]
+        self._open[tid] = (w[1], w[2])
+
+  def refresh(self):
+    # fold whatever other writers appended since the last call
+    with self._lock:
+      try:
+        st = self.path.stat()
+      except FileNotFoundError:
+        self._reset()
+        return
+      if self._loaded and (st.st_ino != self._ino or st.st_size < self._size):
+        self._reset()
+      if not self._loaded:
+        self._ino = st.st_ino
+        self._load_index(st)
+        self._loaded = True
+      if st.st_size == self._size:
+        return
+      with self.path.open("rb") as f:
+        f.seek(self._size)
+        off = self._size
+        for raw in f:
+          if not raw.endswith(b"\n"):
+            break  # partial line, writer still busy
+          try:
+            rec = json.loads(raw)
+            if isinstance(rec, dict):
+              self._fold(rec, off)
+          except Exception:
+            pass
+          off += len(raw)
+      self._dirty += off - self._size
+      self._size = off
+      if self._dirty >= CHECKPOINT_BYTES:
+        self._write_index()
+
+  # ---------- records ----------
+
+  def _open_locked(self):
+    # queue_segments rotates the live file under the same lock; if the path
+    # moved to a new inode while we waited, reopen it
+    while True:
+      f = self.path.open("ab")
+      fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+      try:
+        if os.fstat(f.fileno()).st_ino == self.path.stat().st_ino:
+          return f
+      except FileNotFoundError:
+        pass
+      fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+      f.close()
+
+  def append(self, rec: dict) -> dict:
+    line = (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8")
+    f = self._open_locked()
+    try:
+      f.write(line)
+      f.flush()
+    finally:
+      fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+      f.close()
+    self.refresh()
+    return rec
+
+  def get(self, tid: str) -> dict|None:
+    # the read happens outside the lock, so a rotation can swap the file
+    # under the offset; a record for another id means refresh and retry
+    for _ in range(3):
+      with self._lock:
+        self.refresh()
+        off = self._offsets.get(tid)
+      if off is None:
+        return None
+      try:
+        with self.path.open("rb") as f:
+          f.seek(off)
+          rec = json.loads(f.readline())
+      except Exception:
+        rec = None
+      if isinstance(rec, dict) and rec.get("id") == tid:
+        return rec
+    return None
+
+  def update(self, tid: str, **changes) -> dict|None:
+    rec = self.get(tid)
+    if rec is None:
+      return None
+    rec.update(changes)
+    return self.append(rec)
+
+  def open_ids(self) -> list[tuple[str, str, str]]:
+    # (id, status, kind) of ready tasks only; delayed retries appear once
+    # their not_before passes
+    with self._lock:
+      self.refresh()
+      self._promote()
+      return [(tid, st, kind) for tid, (st, kind) in self._open.items()]
+
+  def next_due(self) -> float|None:
+    with self._lock:
+      self.refresh()
+      while self._heap:
+        nb, tid = self._heap[0]
+        w = self._waiting.get(tid)
+        if w and w[0] == nb:
+          return nb
+        heapq.heappop(self._heap)
+      return None
+
+  def tail(self, limit: int) -> list[dict]:
+    # read backwards from EOF; newest line per id wins
+    limit = max(0, int(limit))
+    out, seen = [], set()
+    try:
+      f = self.path.open("rb")
+    except FileNotFoundError:
+      return []
+    with f:
+      pos = f.seek(0, 2)
+      rest = b""
+      while pos > 0 and len(out) < limit:
+        n = min(TAIL_CHUNK, pos)
+        pos -= n
+        f.seek(pos)
+        buf = f.read(n) + rest
+        lines = buf.split(b"\n")
+        rest = lines.pop(0) if pos > 0 else b""
+        for raw in reversed(lines):
+          if len(out) >= limit:
+            break
+          if not raw.strip():
+            continue
+          try:
+            rec = json.loads(raw)
+          except Exception:
+            continue
+          tid = rec.get("id") if isinstance(rec, dict) else None
+          if tid:
+            if tid in seen:
+              continue
+            seen.add(tid)
+          out.append(rec)
+    out.reverse()
+    return out
@@ -0,0 +1,79 @@
+import os, atexit, socket, threading
+from pathlib import Path
+
+# Wakeups for idle loop workers.
+# In-process waiters block on a Condition guarded by a generation counter.
+# Each worker process also binds a UNIX datagram socket under <queue>/wake/;
+# notify() pokes every bound socket so submits from other processes (the API
+# server, other workers) wake them too.
+
+_COND = threading.Condition()
+_GEN = 0
+_LISTENER = None
+
+def generation() -> int:
+  with _COND:
+    return _GEN
+
+def poke():
+  global _GEN
+  with _COND:
+    _GEN += 1
+    _COND.notify_all()
+
+def wait(gen: int, timeout: float|None) -> bool:
+  # returns True when notified since `gen` was read
+  with _COND:
+    return _COND.wait_for(lambda: _GEN != gen, timeout)
+
+def notify(wake_dir: Path):
+  poke()
+  try:
+    socks = list(Path(wake_dir).glob("*.sock"))
+  except Exception:
+    return
+  me = f"{os.getpid()}.sock"
+  for p in socks:
+    if p.name == me:
+      continue
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+      s.setblocking(False)
+      s.sendto(b"1", str(p))
+    except (ConnectionRefusedError, FileNotFoundError):
+      # owner died without cleaning up
+      try:
+        p.unlink()
+      except Exception:
+        pass
+    except Exception:
+      pass  # receiver buffer full: it is already awake
+    finally:
+      s.close()
+
+def listen(wake_dir: Path) -> bool:
+  # bind this process's socket once; False when unavailable (caller polls)
+  global _LISTENER
+  if _LISTENER is not None:
+    return True
+  try:
+    Path(wake_dir).mkdir(parents=True, exist_ok=True)
+    path = Path(wake_dir) / f"{os.getpid()}.sock"
+    path.unlink(missing_ok=True)
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    s.bind(str(path))
+  except Exception:
+    return False
+
+  def _run():
+    while True:
+      try:
+        s.recv(64)
+      except Exception:
+        return
+      poke()
+
+  _LISTENER = threading.Thread(target=_run, name="loop-wakeup", daemon=True)
+  _LISTENER.start()
+  atexit.register(lambda: path.unlink(missing_ok=True))
+  return True
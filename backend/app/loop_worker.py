@@ -1,117 +1,183 @@
-import json, time, traceback
+import os, random, threading, traceback
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 
-from app.loop_queue import TASKS_JL, list_tail, try_lock, unlock, log_line, now
+from app import loop_wakeup, loop_executors
+from app.loop_store import is_open
+from app.loop_queue import get_task, update_task, open_tasks, next_due, checkpoint, listen_wakeups, try_lock, unlock, log_line, now
 
 ROOT_DIR = Path(__file__).resolve().parents[2]
 
-def _read_all() -> list[dict]:
-  try:
-    lines = TASKS_JL.read_text(encoding="utf-8").splitlines()
-  except Exception:
-    return []
-  out = []
-  for ln in lines:
-    try:
-      out.append(json.loads(ln))
-    except Exception:
-      pass
-  return out
-
-def _write_all(records: list[dict]):
-  TASKS_JL.write_text("\n".join(json.dumps(r, ensure_ascii=False) for r in records) + ("\n" if records else ""), encoding="utf-8")
-
-def _pick_next(records: list[dict]) -> dict|None:
-  # first pending or failed with retries left
-  for r in records:
-    if r.get("status") == "pending":
-      return r
-  for r in records:
-    if r.get("status") == "failed" and int(r.get("tries", 0)) < int(r.get("max_retries", 0)):
-      return r
+_CLAIM_LOCK = threading.Lock()
+
+def _candidates() -> list[tuple[str, str]]:
+  # (id, kind): pending first, then failed with retries left; oldest first
+  items = open_tasks()
+  return [(tid, k) for tid, st, k in items if st == "pending"] + [(tid, k) for tid, st, k in items if st == "failed"]
+
+def _claim() -> dict|None:
+  # Walk the open tasks oldest-first and take the first one nobody holds.
+  # The kind's slot is reserved first, straight from the index, so a
+  # saturated kind costs no lock files or log reads; once a kind is full
+  # the rest of its backlog is skipped for this walk.
+  # The O_EXCL lock file makes the claim exclusive across processes, the
+  # in-process lock keeps sibling threads from racing on the same candidate,
+  # and marking the task running before releasing it hides it from the rest.
+  with _CLAIM_LOCK:
+    full = set()
+    for tid, kind in _candidates():
+      if kind in full:
+        continue
+      if not loop_executors.try_reserve(kind):
+        # its kind is at its concurrency limit; leave it for later
+        full.add(kind)
+        continue
+      if not try_lock(tid):
+        loop_executors.release(kind)
+        continue
+      task = get_task(tid)
+      if not task or not is_open(task) or float(task.get("not_before") or 0) > now():
+        # finished or rescheduled by another worker between listing and locking
+        unlock(tid)
+        loop_executors.release(kind)
+        continue
+      update_task(tid, status="running")
+      return task
   return None
 
-def _backoff_seconds(tries: int) -> float:
-  # exponential backoff: 1,2,4,8... capped 20
-  return min(20.0, float(2 ** max(0, tries)))
+# per-kind retry backoff: base * 2^tries capped at `cap`, +/- `jitter` fraction
+BACKOFF_POLICIES = {
+  "default": {"base": 1.0, "cap": 20.0, "jitter": 0.2},
+}
+
+def set_backoff_policy(kind: str, base: float = 1.0, cap: float = 20.0, jitter: float = 0.2):
+  BACKOFF_POLICIES[kind] = {"base": float(base), "cap": float(cap), "jitter": float(jitter)}
 
-def _execute_task(task: dict) -> dict:
-  kind = (task.get("kind") or "").strip()
-  payload = task.get("payload") or {}
+def _backoff_seconds(kind: str, tries: int) -> float:
+  # exponential backoff: 2,4,8... capped 20 by default
+  pol = BACKOFF_POLICIES.get(kind) or BACKOFF_POLICIES["default"]
+  delay = min(pol["cap"], pol["base"] * float(2 ** max(0, tries)))
+  j = pol["jitter"]
+  return max(0.0, delay * (1.0 + random.uniform(-j, j)))
+
+def _fail(task: dict, tries: int, error: str, result: dict):
+  # reschedule instead of sleeping: the task waits in the delay queue
+  # while this worker moves on to other ready work
+  tid = task["id"]
+  nb = now() + _backoff_seconds(_kind(task), tries)
+  update_task(tid, tries=tries, status="failed", result=result, last_error=error, not_before=nb)
 
-  # Extend here later: git ops, render ops, llm ops, etc.
-  if kind == "ping":
-    return {"ok": True, "kind": "ping", "ts": now(), "payload": payload}
+def _kind(task: dict) -> str:
+  return (task.get("kind") or "").strip()
 
-  if kind == "echo":
-    return {"ok": True, "kind": "echo", "payload": payload}
+# built-in kinds; register more with loop_executors.register / task_kind
+@loop_executors.task_kind("ping", mode="inline", limit=8)
+def _ping(payload: dict) -> dict:
+  return {"ok": True, "kind": "ping", "ts": now(), "payload": payload}
 
-  # unknown
-  return {"ok": False, "error": "unknown_task_kind", "kind": kind, "payload": payload}
+@loop_executors.task_kind("echo", mode="inline", limit=8)
+def _echo(payload: dict) -> dict:
+  return {"ok": True, "kind": "echo", "payload": payload}
+
+@loop_executors.task_kind("git_status", mode="subprocess", limit=1)
+def _git_status(payload: dict) -> dict:
+  return {"cmd": ["git", "status", "--porcelain"], "cwd": str(ROOT_DIR), "timeout": 30}
+
+# completion callbacks land on executor threads (process pool manager, io
+# loop); the bookkeeping runs here instead so those are never held up
+_FINISH = ThreadPoolExecutor(max_workers=2, thread_name_prefix="loop-finish")
 
 def run_once() -> dict:
-  records = _read_all()
-  task = _pick_next(records)
+  # Claims one task and starts it. Inline kinds finish before this returns;
+  # process/io/subprocess kinds finish from their future's callback, which
+  # marks the task, frees its slot and lock and pokes idle workers, so the
+  # worker goes straight back to claiming.
+  task = _claim()
   if not task:
     return {"ok": True, "message": "no_tasks"}
 
   tid = task["id"]
-  if not try_lock(tid):
-    return {"ok": True, "message": "locked_skip", "task_id": tid}
+  try:
+    out = loop_executors.submit(_kind(task), task.get("payload") or {})
+  except Exception as e:
+    return _finish(task, error=e, trace=traceback.format_exc())
+  if isinstance(out, Future):
+    out.add_done_callback(lambda fut: _FINISH.submit(_finish_future, task, fut))
+    return {"ok": True, "task_id": tid, "started": True}
+  return _finish(task, out)
 
+def _finish_future(task: dict, fut: Future) -> dict:
   try:
-    # backoff if retrying
-    tries = int(task.get("tries", 0))
-    if task.get("status") == "failed" and tries > 0:
-      time.sleep(_backoff_seconds(tries))
-
-    # mark running
-    for r in records:
-      if r.get("id") == tid:
-        r["status"] = "running"
-        r["updated_at"] = now()
-    _write_all(records)
-
-    # execute
-    res = _execute_task(task)
-
-    # mark done/failed
-    records = _read_all()
-    for r in records:
-      if r.get("id") == tid:
-        r["tries"] = int(r.get("tries", 0)) + 1
-        r["updated_at"] = now()
+    res = fut.result()
+  except Exception as e:
+    return _finish(task, error=e, trace="".join(traceback.format_exception(e)))
+  return _finish(task, res)
+
+def _finish(task: dict, res: dict|None = None, error: Exception|None = None, trace: str = "") -> dict:
+  tid = task["id"]
+  try:
+    if error is None:
+      try:
+        tries = int(task.get("tries", 0))
+
+        # mark done/failed
         if res.get("ok"):
-          r["status"] = "done"
-          r["result"] = res
-          r["last_error"] = ""
+          update_task(tid, tries=tries + 1, status="done", result=res, last_error="")
         else:
-          r["status"] = "failed"
-          r["result"] = res
-          r["last_error"] = str(res.get("error") or "failed")
-    _write_all(records)
+          _fail(task, tries + 1, str(res.get("error") or "failed"), res)
 
-    log_line(f"[RUN] {tid} kind={task.get('kind')} status={'done' if res.get('ok') else 'failed'}")
-    return {"ok": True, "task_id": tid, "result": res}
+        log_line(f"[RUN] {tid} kind={task.get('kind')} status={'done' if res.get('ok') else 'failed'}")
+        return {"ok": True, "task_id": tid, "result": res}
+      except Exception as e:
+        error, trace = e, traceback.format_exc()
 
-  except Exception as e:
-    records = _read_all()
-    for r in records:
-      if r.get("id") == tid:
-        r["tries"] = int(r.get("tries", 0)) + 1
-        r["updated_at"] = now()
-        r["status"] = "failed"
-        r["last_error"] = str(e)
-        r["result"] = {"ok": False, "error": str(e), "trace": traceback.format_exc()}
-    _write_all(records)
-    log_line(f"[ERR] {tid} {e}")
-    return {"ok": False, "task_id": tid, "error": str(e)}
+    cur = get_task(tid) or {}
+    _fail(task, int(cur.get("tries", 0)) + 1, str(error),
+      {"ok": False, "error": str(error), "trace": trace})
+    log_line(f"[ERR] {tid} {error}")
+    return {"ok": False, "task_id": tid, "error": str(error)}
 
   finally:
+    loop_executors.release(_kind(task))
     unlock(tid)
-
-def daemon_loop(interval_sec: float = 2.0):
-  log_line("[BOOT] dynamo_worker started")
+    # a freed slot may unblock tasks idle workers skipped
+    loop_wakeup.poke()
+
+def _idle_timeout(poll_sec: float|None) -> float|None:
+  # sleep until the next delayed retry is due, a submit wakes us, or the
+  # fallback poll interval (only used when wakeups are unavailable)
+  due = next_due()
+  t = None if due is None else max(0.0, due - now())
+  if poll_sec is not None:
+    t = poll_sec if t is None else min(t, poll_sec)
+  return t
+
+def _worker_loop(name: str, poll_sec: float|None):
   while True:
-    run_once()
-    time.sleep(max(0.5, float(interval_sec)))
+    gen = loop_wakeup.generation()
+    try:
+      res = run_once()
+    except Exception as e:
+      log_line(f"[ERR] {name} {e}")
+      res = {"message": "no_tasks"}
+    # keep draining while there is work; only idle workers wait
+    if res.get("message") == "no_tasks":
+      loop_wakeup.wait(gen, _idle_timeout(poll_sec))
+
+def daemon_loop(interval_sec: float = 2.0, workers: int|None = None):
+  # workers > 1 runs a thread pool; every thread claims its own task.
+  # interval_sec is only the fallback poll when the wakeup socket can't be bound.
+  n = int(workers or os.environ.get("STATION_LOOP_WORKERS") or 1)
+  poll_sec = None if listen_wakeups() else max(0.5, float(interval_sec))
+  log_line(f"[BOOT] dynamo_worker started workers={n} poll={poll_sec or 'event'}")
+  checkpoint()
+  if n <= 1:
+    _worker_loop("w0", poll_sec)
+    return
+  threads = []
+  for i in range(n):
+    th = threading.Thread(target=_worker_loop, args=(f"w{i}", poll_sec), name=f"loop-worker-{i}", daemon=True)
+    th.start()
+    threads.append(th)
+  for th in threads:
+    th.join()
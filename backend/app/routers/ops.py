@@ -3,6 +3,7 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from app.core.config import settings
 from app.services.store import read_settings
+from app.core import gitcache
 
 router = APIRouter(tags=["ops"])
 
@@ -19,8 +20,9 @@ class OpsIn(BaseModel):
 @router.get("/api/ops/git/status")
 def git_status():
     root = os.path.expanduser(settings.station_root) or os.path.expanduser("~/station_root")
-    r = subprocess.run(["bash","-lc", f"cd {shlex.quote(root)} && git status -sb || true"], capture_output=True, text=True)
-    return {"ok": True, "out": r.stdout[-4000:]}
+    # `git status -sb` prints the same lines as porcelain -b
+    r = gitcache.status_sync(root, branch=True)
+    return {"ok": True, "out": (r.stdout or r.stderr)[-4000:]}
 
 @router.post("/api/ops/git/push")
 def git_push(p: OpsIn):
@@ -1,8 +1,9 @@
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 from starlette.requests import Request
 from starlette.routing import Route
 
 from app.settings_store import expected_edit_key
+from app.core import procs
 from app.guards import require_room
 
 # Console commands are aliases to ops_run_cmd allowlist keys
@@ -40,26 +41,26 @@ async def post_console(request: Request):
 
   # Import ops_run_cmd handler logic locally (no subprocess duplication)
   from app.routes.ops_run_cmd import ALLOWED
-  import subprocess
   from pathlib import Path
 
   if cmd not in ALLOWED:
     return JSONResponse({"ok": False, "error": "cmd_not_allowed"}, status_code=400)
 
+  cwd = str(Path(__file__).resolve().parents[3])
+  if str(body.get("stream") or "").lower() in ("1", "true", "yes"):
+    # server-sent events: one event per output line, then "exit"
+    return StreamingResponse(procs.sse(ALLOWED[cmd], cwd=cwd, out_cap=6000, on_exit=lambda r: {"input": line, "cmd": cmd}),
+                             media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
   try:
-    p = subprocess.run(
-      ALLOWED[cmd],
-      capture_output=True,
-      text=True,
-      cwd=str(Path(__file__).resolve().parents[3])
-    )
+    r = await procs.run(ALLOWED[cmd], cwd=cwd, out_cap=6000)
     return JSONResponse({
       "ok": True,
       "line": line,
       "cmd": cmd,
-      "returncode": p.returncode,
-      "stdout": (p.stdout or "")[-6000:],
-      "stderr": (p.stderr or "")[-6000:]
+      "returncode": r.rc,
+      "stdout": r.stdout,
+      "stderr": r.stderr
     })
   except Exception as e:
     return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
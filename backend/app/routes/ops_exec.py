@@ -1,13 +1,16 @@
-import os, json, time, subprocess
+import os, json, time
 from pathlib import Path
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 from starlette.requests import Request
 from starlette.routing import Route
 from app.uui_store import expected_edit_key
+from app.core import procs
 
 ROOT = Path(__file__).resolve().parents[2]
 LOG = ROOT / "backend" / "app" / "ops_logs" / "ops_exec.log.jsonl"
 LOG.parent.mkdir(parents=True, exist_ok=True)
+# characters of each stream kept in the log entry (the tail), both modes
+LOG_CAP = 8000
 
 ALLOW = {
     "pwd": ["pwd"],
@@ -43,17 +46,22 @@ async def exec_cmd(request: Request):
         cwd = str(ROOT)
 
     entry = {"ts": now_iso(), "name": name, "cmd": cmd, "cwd": cwd}
-    try:
-        p = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, timeout=20)
-        entry["rc"] = p.returncode
-        entry["stdout"] = (p.stdout or "")[:8000]
-        entry["stderr"] = (p.stderr or "")[:8000]
-    except Exception as e:
-        entry["rc"] = -1
-        entry["stderr"] = str(e)
 
-    with LOG.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    def _record(r: procs.Result) -> dict:
+        entry["rc"] = r.rc
+        entry["stdout"] = r.stdout[-LOG_CAP:]
+        entry["stderr"] = r.stderr[-LOG_CAP:]
+        with LOG.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return {"name": name}
+
+    # "stream": true answers with server-sent events as output arrives;
+    # the log entry is written when the command exits
+    if str(body.get("stream") or "").lower() in ("1", "true", "yes"):
+        return StreamingResponse(procs.sse(cmd, cwd=cwd, timeout=20, out_cap=LOG_CAP, on_exit=_record),
+                                 media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    _record(await procs.run(cmd, cwd=cwd, timeout=20, out_cap=LOG_CAP))
 
     return JSONResponse({"ok": True, "entry": entry, "allowed": sorted(ALLOW.keys())})
 
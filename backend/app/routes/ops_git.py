@@ -1,6 +1,7 @@
-import os, json, subprocess
-from starlette.responses import JSONResponse
+import os, json, asyncio
+from starlette.responses import JSONResponse, StreamingResponse
 from starlette.requests import Request
+from app.core import procs, gitcache
 
 ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
 UUI_STORE = os.path.abspath(os.path.join(ROOT_DIR, "station_meta", "bindings", "uui_config.json"))
@@ -27,27 +28,22 @@ def _auth_ok(request: Request) -> bool:
     got = (request.headers.get("X-Edit-Key") or "").strip()
     return got != "" and got == _edit_key_expected()
 
-def _run(cmd: list[str]) -> tuple[int, str]:
-    p = subprocess.Popen(
-        cmd,
-        cwd=ROOT_DIR,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True
-    )
-    out = []
-    for line in p.stdout:
-        out.append(line)
-    p.wait()
-    return p.returncode, "".join(out)
+def _wants_stream(request: Request, body: dict) -> bool:
+    # ?stream=1 (or "stream": true) answers with server-sent events as output arrives
+    v = request.query_params.get("stream") or body.get("stream") or ""
+    return str(v).strip().lower() in ("1", "true", "yes")
 
 async def git_status(request: Request):
     if not _auth_ok(request):
         return JSONResponse({"error": "forbidden"}, status_code=403)
 
-    rc1, out1 = _run(["bash", "-lc", "git status --porcelain=v1 || true"])
-    rc2, out2 = _run(["bash", "-lc", "git log --oneline -n 5 || true"])
-    rc3, out3 = _run(["bash", "-lc", "git remote -v || true"])
+    # answered from the git cache until .git changes (status also ages out)
+    r1, r2, r3 = await asyncio.gather(
+        gitcache.status(ROOT_DIR),
+        gitcache.log(ROOT_DIR, 5),
+        gitcache.remote(ROOT_DIR),
+    )
+    (rc1, out1), (rc2, out2), (rc3, out3) = [(r.rc, r.stdout or r.stderr) for r in (r1, r2, r3)]
 
     return JSONResponse({
         "ok": True,
@@ -78,22 +74,16 @@ async def git_push(request: Request):
     if not os.path.exists(script):
         return JSONResponse({"error": "stage_commit_push.sh not found"}, status_code=500)
 
-    p = subprocess.Popen(
-        ["bash", script, str(root_id), msg],
-        cwd=ROOT_DIR,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        env=env
-    )
-    out = []
-    for line in p.stdout:
-        out.append(line)
-    p.wait()
-    tail = "".join(out)[-2200:]
+    cmd = ["bash", script, str(root_id), msg]
+    if _wants_stream(request, body):
+        return StreamingResponse(procs.sse(cmd, cwd=ROOT_DIR, env=env, merge_stderr=True, timeout=600),
+                                 media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    r = await procs.run(cmd, cwd=ROOT_DIR, env=env, merge_stderr=True, timeout=600)
+    tail = r.stdout[-2200:]
 
     return JSONResponse({
-        "ok": p.returncode == 0,
-        "rc": p.returncode,
+        "ok": r.ok,
+        "rc": r.rc,
         "out_tail": tail
     })
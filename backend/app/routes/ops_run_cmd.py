@@ -1,9 +1,9 @@
-import subprocess
 from starlette.responses import JSONResponse
 from starlette.requests import Request
 from starlette.routing import Route
 from app.settings_store import expected_edit_key
 from app.guards import require_room
+from app.core import procs
 
 ALLOWED = {
   "pwd": ["pwd"],
@@ -32,18 +32,17 @@ async def run_cmd(request: Request):
     return JSONResponse({"ok": False, "error": "cmd_not_allowed", "allowed": list(ALLOWED.keys())}, status_code=400)
 
   try:
-    p = subprocess.run(
+    r = await procs.run(
       ALLOWED[cmd_key],
-      capture_output=True,
-      text=True,
-      cwd=str((__import__("pathlib").Path(__file__).resolve().parents[3]))
+      cwd=str((__import__("pathlib").Path(__file__).resolve().parents[3])),
+      out_cap=4000
     )
     return JSONResponse({
       "ok": True,
       "cmd": cmd_key,
-      "returncode": p.returncode,
-      "stdout": p.stdout[-4000:],
-      "stderr": p.stderr[-4000:]
+      "returncode": r.rc,
+      "stdout": r.stdout,
+      "stderr": r.stderr
     })
   except Exception as e:
     return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
@@ -1,7 +1,7 @@
 import os
-import time
 from pathlib import Path
 from typing import Optional
+from .app.core import filelock
 
 LOCK_DIR = Path(os.environ.get("STATION_LOCK_DIR", str(Path.home() / "station_root" / "global" / "locks")))
 LOCK_DIR.mkdir(parents=True, exist_ok=True)
@@ -17,21 +17,15 @@ def lock_path(name: str) -> Path:
     return LOCK_DIR / f"{name}.lock"
 
 def try_lock(name: str, ttl_sec: int = 120) -> bool:
-    p = lock_path(name)
-    now = int(time.time())
-    if p.exists():
-        try:
-            ts = int(p.read_text().strip() or "0")
-        except Exception:
-            ts = 0
-        if now - ts < ttl_sec:
-            return False
-    p.write_text(str(now))
-    return True
+    # kernel flock held until unlock() or until this process exits
+    try:
+        filelock.acquire(str(lock_path(name)), f"pid:{os.getpid()}", ttl_sec, timeout=0, name=name)
+        return True
+    except (OSError, RuntimeError):
+        return False
 
 def unlock(name: str) -> None:
-    p = lock_path(name)
     try:
-        p.unlink(missing_ok=True)
+        filelock.release(str(lock_path(name)))
     except Exception:
         pass
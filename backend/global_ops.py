@@ -1,30 +1,26 @@
 import os
 import json
-import subprocess
 from pathlib import Path
 from starlette.responses import JSONResponse
 from starlette.requests import Request
+from .app.core import procs, gitcache
 from .global_guards import require_edit_key, try_lock, unlock
 
 ROOT = Path(os.environ.get("STATION_ROOT", str(Path.home() / "station_root")))
 
-def _run(cmd, cwd=None):
-    p = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, shell=False)
-    return p.returncode, p.stdout.strip(), p.stderr.strip()
+async def _run(cmd, cwd=None, timeout=procs.DEFAULT_TIMEOUT):
+    r = await procs.run(cmd, cwd=cwd, timeout=timeout)
+    return r.rc, r.stdout.strip(), r.stderr.strip()
 
 async def ops_git_status(request: Request):
     err = require_edit_key(request.headers)
     if err:
         return JSONResponse({"ok": False, "error": err}, status_code=401)
 
-    if not try_lock("ops_git_status", ttl_sec=10):
-        return JSONResponse({"ok": False, "error": "locked"}, status_code=423)
-
-    try:
-        code, out, e = _run(["git", "status", "--porcelain", "-b"], cwd=str(ROOT))
-        return JSONResponse({"ok": code == 0, "code": code, "stdout": out, "stderr": e})
-    finally:
-        unlock("ops_git_status")
+    # cached until .git changes; concurrent polls share one git process,
+    # so this no longer needs the ops_git_status lock
+    r = await gitcache.status(str(ROOT), branch=True)
+    return JSONResponse({"ok": r.rc == 0, "code": r.rc, "stdout": r.stdout.strip(), "stderr": r.stderr.strip()})
 
 async def ops_git_push(request: Request):
     err = require_edit_key(request.headers)
@@ -38,10 +34,10 @@ async def ops_git_push(request: Request):
         body = await request.json()
         msg = (body.get("message") or "GLOBAL: update").strip()
 
-        code1, out1, e1 = _run(["git", "add", "-A"], cwd=str(ROOT))
-        code2, out2, e2 = _run(["git", "commit", "-m", msg], cwd=str(ROOT))
+        code1, out1, e1 = await _run(["git", "add", "-A"], cwd=str(ROOT))
+        code2, out2, e2 = await _run(["git", "commit", "-m", msg], cwd=str(ROOT))
         # commit might fail if no changes
-        code3, out3, e3 = _run(["git", "push", "-u", "origin", "main"], cwd=str(ROOT))
+        code3, out3, e3 = await _run(["git", "push", "-u", "origin", "main"], cwd=str(ROOT), timeout=600)
 
         return JSONResponse({
             "ok": code3 == 0,
@@ -70,7 +66,7 @@ async def ops_render_deploy(request: Request):
             return JSONResponse({"ok": False, "error": "missing_render_deploy_hook_url"}, status_code=400)
 
         # Use curl if available
-        code, out, e = _run(["curl", "-sS", "-X", "POST", hook], cwd=str(ROOT))
+        code, out, e = await _run(["curl", "-sS", "-X", "POST", hook], cwd=str(ROOT))
         return JSONResponse({"ok": code == 0, "code": code, "stdout": out, "stderr": e})
     finally:
         unlock("ops_render_deploy")
@@ -1,11 +1,9 @@
-import os, platform, subprocess, pathlib
+import os, platform, pathlib
+from app.core import procs
 
 def _cmd(s: str) -> str:
-    try:
-        out = subprocess.check_output(s, shell=True, stderr=subprocess.STDOUT, timeout=3)
-        return out.decode("utf-8", "ignore").strip()
-    except Exception:
-        return ""
+    r = procs.run_sync(s, merge_stderr=True, timeout=3)
+    return r.stdout.strip() if r.ok else ""
 
 def doctor(_payload=None):
     root = os.environ.get("STATION_ROOT", str(pathlib.Path.home() / "station_root"))
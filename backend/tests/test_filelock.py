@@ -0,0 +1,59 @@
+import os
+import sys
+import subprocess
+import tempfile
+import unittest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from app.core import filelock
+
+# holds every slot of the semaphore, then frees them all at once when stdin closes
+HOLD_ALL = """
+import sys
+from app.core import filelock
+sem = filelock.Semaphore(sys.argv[1], "s", int(sys.argv[2]))
+held = [sem.acquire("holder", timeout=0) for _ in range(sem.slots)]
+assert all(held)
+print("held", flush=True)
+sys.stdin.read()
+"""
+
+# counts the slots another process can still take without waiting
+COUNT_FREE = """
+import sys
+from app.core import filelock
+sem = filelock.Semaphore(sys.argv[1], "s", int(sys.argv[2]))
+print(sum(sem.acquire("probe", timeout=0) is not None for _ in range(sem.slots)))
+"""
+
+class SemaphoreWaitTest(unittest.TestCase):
+    SLOTS = 4
+
+    def _py(self, code, lock_dir, **kw):
+        env = dict(os.environ, PYTHONPATH=BACKEND)
+        return subprocess.Popen([sys.executable, "-c", code, lock_dir, str(self.SLOTS)],
+                                env=env, text=True, stdout=subprocess.PIPE, **kw)
+
+    def test_slots_freed_together_go_back_to_other_processes(self):
+        for _ in range(10):
+            with tempfile.TemporaryDirectory() as lock_dir:
+                holder = self._py(HOLD_ALL, lock_dir, stdin=subprocess.PIPE)
+                self.assertEqual(holder.stdout.readline().strip(), "held")
+                sem = filelock.Semaphore(lock_dir, "s", self.SLOTS)
+                self.assertIsNone(sem.acquire("me", timeout=0.2))
+                # every slot frees at once while we wait on all of them
+                holder.stdin.close()
+                lk = sem.acquire("me", timeout=5)
+                holder.wait()
+                self.assertIsNotNone(lk)
+                try:
+                    probe = self._py(COUNT_FREE, lock_dir)
+                    out, _ = probe.communicate(timeout=10)
+                    self.assertEqual(int(out), self.SLOTS - 1)
+                finally:
+                    lk.release()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,14 @@
 from __future__ import annotations
-from starlette.responses import JSONResponse
+import json
+from starlette.responses import JSONResponse, StreamingResponse
 from starlette.requests import Request
 from starlette.routing import Route
 from .state import STATE
-from .dynamo import run_factory
-from .taskbus import submit, next_task, report, recent
+from .dynamo import start_factory, DEPS
+from .taskbus import submit_async, wait_task, report_async, recent
+
+MAX_WAIT = 60
+KEEPALIVE = 15
 
 def _edit_ok(req: Request) -> bool:
     # keep minimal: presence of header.
@@ -14,47 +18,92 @@ def _edit_ok(req: Request) -> bool:
 async def uul_factory_run(req: Request):
     if not _edit_ok(req):
         return JSONResponse({"ok":False,"error":"missing x-edit-key"}, status_code=401)
-    run_factory()
-    return JSONResponse({"ok":True,"running":STATE.running})
+    started = start_factory()
+    return JSONResponse({"ok":True,"started":started,"running":True})
 
 async def uul_factory_status(req: Request):
-    tail = int(req.query_params.get("tail","160"))
-    rooms = {k: {"status":v.status,"updated_at":v.updated_at,"last_error":v.last_error} for k,v in STATE.rooms.items()}
+    # ?since=<log_seq from the previous poll> returns only the new log lines
+    tail = max(10, min(4000, int(req.query_params.get("tail","160"))))
+    since = req.query_params.get("since")
+    rooms = {k: {
+        "status":v.status,
+        "updated_at":v.updated_at,
+        "last_error":v.last_error,
+        "started_at":v.started_at,
+        "finished_at":v.finished_at,
+        "duration_sec":v.duration(),
+        "deps":DEPS.get(k, []),
+    } for k,v in STATE.rooms.items()}
+    first, lines = STATE.logs.since(int(since) if since else 0, tail)
     return JSONResponse({
         "ok":True,
         "running":STATE.running,
         "started_at":STATE.started_at,
         "rooms":rooms,
-        "log_tail": STATE.logs[-max(10, min(4000, tail)):]
+        "log_tail": lines,
+        "log_first_seq": first,
+        "log_seq": STATE.logs.seq,
     })
 
 async def uul_task_submit(req: Request):
     if not _edit_ok(req):
         return JSONResponse({"ok":False,"error":"missing x-edit-key"}, status_code=401)
-    body = await req.json()
+    try:
+        body = await req.json()
+    except Exception:
+        body = {}
+    if not isinstance(body, dict):
+        return JSONResponse({"ok":False,"error":"bad_body"}, status_code=400)
     task_type = body.get("task_type","shell")
     payload = body.get("payload",{})
-    tid = submit(task_type, payload)
+    tid = await submit_async(task_type, payload)
     return JSONResponse({"ok":True,"task_id":tid})
 
+def _wait_sec(req: Request) -> float:
+    try:
+        return max(0.0, min(MAX_WAIT, float(req.query_params.get("wait","0"))))
+    except ValueError:
+        return 0.0
+
+def _task_json(t) -> dict:
+    return {"id":t.id, "task_type":t.task_type, "payload":t.payload}
+
 async def uul_task_next(req: Request):
+    # ?wait=N long-polls up to N seconds for a task instead of returning null
     runner_id = req.query_params.get("runner_id","runner-local")
-    t = next_task(runner_id)
+    t = await wait_task(runner_id, _wait_sec(req))
     if not t:
         return JSONResponse({"ok":True,"task":None})
-    return JSONResponse({"ok":True,"task":{
-        "id":t.id,
-        "task_type":t.task_type,
-        "payload":t.payload
-    }})
+    return JSONResponse({"ok":True,"task":_task_json(t)})
+
+async def uul_task_stream(req: Request):
+    # server-sent events: one "task" event per assignment, comments as keepalive
+    runner_id = req.query_params.get("runner_id","runner-local")
+
+    async def events():
+        while not await req.is_disconnected():
+            t = await wait_task(runner_id, KEEPALIVE)
+            if t is None:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: task\ndata: {json.dumps(_task_json(t))}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control":"no-cache"})
 
 async def uul_task_report(req: Request):
-    body = await req.json()
-    task_id = int(body.get("task_id",0))
+    try:
+        body = await req.json()
+    except Exception:
+        body = {}
+    try:
+        task_id = int(body.get("task_id",0))
+    except (AttributeError, TypeError, ValueError):
+        return JSONResponse({"ok":False,"error":"bad_task_id"}, status_code=400)
     ok = bool(body.get("ok",False))
     result = body.get("result")
     error = body.get("error")
-    done = report(task_id, ok, result=result, error=error)
+    done = await report_async(task_id, ok, result=result, error=error)
     return JSONResponse({"ok":done})
 
 async def uul_task_recent(req: Request):
@@ -79,6 +128,7 @@ def routes():
         Route("/uul/factory/status", uul_factory_status, methods=["GET"]),
         Route("/uul/tasks/submit", uul_task_submit, methods=["POST"]),
         Route("/uul/tasks/next", uul_task_next, methods=["GET"]),
+        Route("/uul/tasks/stream", uul_task_stream, methods=["GET"]),
         Route("/uul/tasks/report", uul_task_report, methods=["POST"]),
         Route("/uul/tasks/recent", uul_task_recent, methods=["GET"]),
     ]
@@ -1,7 +1,10 @@
 from __future__ import annotations
+import os
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from .state import STATE, RoomState
-from . import rooms
+from . import rooms, store
 
 ROOMS = {
     "core": rooms.core,
@@ -14,37 +17,104 @@ ROOMS = {
 
 ORDER = ["core","backend","frontend","tests","git_pipeline","render_deploy"]
 
+# room -> rooms that must finish ("done") first. Rooms whose dependencies are
+# met run concurrently; dependents of a failed room are skipped.
+DEPS = {
+    "core": [],
+    "backend": ["core"],
+    "frontend": ["core"],
+    "tests": ["backend"],
+    "git_pipeline": ["core"],
+    "render_deploy": ["tests", "frontend", "git_pipeline"],
+}
+
+WORKERS = int(os.getenv("UUL_FACTORY_WORKERS", "4"))
+
+_RUN_LOCK = threading.Lock()
+
 def ensure_rooms():
     for n in ORDER:
         if n not in STATE.rooms:
             STATE.rooms[n] = RoomState(name=n)
 
+def _set(rs: RoomState, status: str, err: str = "") -> None:
+    now = time.time()
+    if status == "running":
+        rs.started_at, rs.finished_at = now, None
+    elif status in ("done", "error"):
+        rs.finished_at = now
+    elif status in ("waiting", "skipped"):
+        rs.started_at = rs.finished_at = None
+    rs.status = status
+    rs.updated_at = int(now)
+    rs.last_error = err
+    store.save_room(rs)
+    STATE.log(f"[dynamo] room={rs.name} status={status}" + (f" err={err}" if err else ""))
+
+def _run_room(n: str) -> None:
+    _set(STATE.rooms[n], "running")
+    ROOMS[n]()
+
 def run_factory():
+    # run every room once, in dependency order, independent rooms in parallel
     ensure_rooms()
-    if STATE.running:
+    if not _RUN_LOCK.acquire(blocking=False):
         STATE.log("[dynamo] already running")
         return
+    _run_locked()
+
+def _run_locked():
+    # the caller holds _RUN_LOCK; it is released when the run ends
     STATE.running = True
     STATE.started_at = int(time.time())
     STATE.log("[dynamo] START")
     try:
+        pending = {n: set(DEPS.get(n, [])) for n in ORDER}
         for n in ORDER:
-            rs = STATE.rooms[n]
-            rs.status = "running"
-            rs.updated_at = int(time.time())
-            rs.last_error = ""
-            STATE.log(f"[dynamo] room={n} status=running")
-            try:
-                ROOMS[n]()
-                rs.status = "done"
-                rs.updated_at = int(time.time())
-                STATE.log(f"[dynamo] room={n} status=done")
-            except Exception as e:
-                rs.status = "error"
-                rs.updated_at = int(time.time())
-                rs.last_error = str(e)
-                STATE.log(f"[dynamo] room={n} status=error err={e}")
-                break
+            _set(STATE.rooms[n], "waiting")
+        with ThreadPoolExecutor(max_workers=max(1, WORKERS), thread_name_prefix="uul-room") as pool:
+            running = {}
+            while pending or running:
+                for n in [n for n, deps in pending.items() if not deps]:
+                    del pending[n]
+                    running[pool.submit(_run_room, n)] = n
+                if not running:
+                    break  # dependency cycle or unknown dependency
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    n = running.pop(fut)
+                    err = fut.exception()
+                    if err is None:
+                        _set(STATE.rooms[n], "done")
+                        for deps in pending.values():
+                            deps.discard(n)
+                        continue
+                    _set(STATE.rooms[n], "error", str(err))
+                    failed = [n]
+                    while failed:
+                        f = failed.pop()
+                        for m in [m for m, deps in pending.items() if f in deps]:
+                            del pending[m]
+                            _set(STATE.rooms[m], "skipped", f"dependency {f} failed")
+                            failed.append(m)
+            for n in pending:
+                _set(STATE.rooms[n], "skipped", "unresolved dependencies")
     finally:
         STATE.running = False
         STATE.log("[dynamo] STOP")
+        _RUN_LOCK.release()
+
+def start_factory() -> bool:
+    # run_factory on a background thread; False if a run is already going
+    # the lock is taken here, not in the thread, so two callers can't both start one
+    if not _RUN_LOCK.acquire(blocking=False):
+        return False
+    STATE.running = True
+    try:
+        ensure_rooms()
+        threading.Thread(target=_run_locked, name="uul-factory", daemon=True).start()
+    except BaseException:
+        STATE.running = False
+        _RUN_LOCK.release()
+        raise
+    return True
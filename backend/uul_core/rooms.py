@@ -1,13 +1,14 @@
 from __future__ import annotations
-import os, subprocess
+import os
+from app.core import procs
 from .state import STATE
 
 ROOT = os.path.expanduser("~/station_root")
 
 def _run(cmd: str, cwd: str | None = None) -> tuple[int, str]:
-    p = subprocess.Popen(cmd, cwd=cwd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    out, _ = p.communicate()
-    return p.returncode, (out or "").strip()
+    # rooms run on factory worker threads; the shared engine bounds concurrency
+    r = procs.run_sync(cmd, cwd=cwd, merge_stderr=True)
+    return r.rc, r.stdout.strip()
 
 def core():
     STATE.log("[room:core] start")
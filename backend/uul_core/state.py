@@ -1,7 +1,14 @@
 from __future__ import annotations
 import time
+import threading
+from collections import deque
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Any
+from typing import Deque, Dict, List, Optional, Any, Tuple
+
+# how many tasks (any status) recent() can look back over
+TASK_HISTORY = 2000
+# log lines kept in memory
+LOG_CAPACITY = 4000
 
 def now_ts() -> int:
     return int(time.time())
@@ -9,11 +16,19 @@ def now_ts() -> int:
 @dataclass
 class RoomState:
     name: str
-    status: str = "idle"  # idle|running|done|error
+    status: str = "idle"  # idle|waiting|running|done|error|skipped
     updated_at: int = field(default_factory=now_ts)
     last_error: str = ""
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
 
-@dataclass
+    def duration(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        end = self.finished_at if self.finished_at is not None else time.time()
+        return round(end - self.started_at, 3)
+
+@dataclass(slots=True)
 class Task:
     id: int
     created_at: int
@@ -24,20 +39,70 @@ class Task:
     error: Optional[str] = None
     runner_id: Optional[str] = None
 
+class LogRing:
+    # Fixed-capacity ring of log lines. Line k (0-based, ever increasing) lives
+    # in slot k % capacity; readers ask for lines since a sequence number and
+    # only what they have not seen is copied out.
+    __slots__ = ("capacity", "seq", "_buf", "_lock")
+
+    def __init__(self, capacity: int = LOG_CAPACITY) -> None:
+        self.capacity = max(1, int(capacity))
+        self.seq = 0  # sequence number the next line will get
+        self._buf: List[Optional[str]] = [None] * self.capacity
+        self._lock = threading.Lock()  # factory rooms log from worker threads
+
+    def append(self, line: str) -> int:
+        with self._lock:
+            n = self.seq
+            self._buf[n % self.capacity] = line
+            self.seq = n + 1
+        return n
+
+    def first_seq(self) -> int:
+        return max(0, self.seq - self.capacity)
+
+    def since(self, seq: int, limit: Optional[int] = None) -> Tuple[int, List[str]]:
+        # (first returned seq, lines with seq >= `seq`); the start is clamped
+        # to the oldest line still held, and `limit` keeps the newest ones.
+        # A seq past the end comes from an older ring (server restart): the
+        # reader starts over from the oldest line held.
+        with self._lock:
+            end = self.seq
+            first = max(0, end - self.capacity)
+            seq = int(seq)
+            start = first if seq > end else max(seq, first)
+            if limit is not None:
+                start = max(start, end - max(0, int(limit)))
+            if start >= end:
+                return end, []
+            cap = self.capacity
+            a, b = start % cap, end % cap
+            if a < b:
+                return start, self._buf[a:b]
+            return start, self._buf[a:] + self._buf[:b]
+
+    def tail(self, n: int) -> List[str]:
+        return self.since(0, n)[1]
+
+    def __len__(self) -> int:
+        return self.seq - self.first_seq()
+
 @dataclass
 class UULState:
     running: bool = False
     started_at: Optional[int] = None
     rooms: Dict[str, RoomState] = field(default_factory=dict)
-    logs: List[str] = field(default_factory=list)
-    tasks: List[Task] = field(default_factory=list)
+    logs: LogRing = field(default_factory=LogRing)
+    # live (queued|running) tasks by id; finished ones drop out on report
+    tasks: Dict[int, Task] = field(default_factory=dict)
+    # ids waiting for a runner, in dispatch order
+    queue: Deque[int] = field(default_factory=deque)
+    # every submitted task, newest last; bounded so memory stays flat
+    history: Deque[Task] = field(default_factory=lambda: deque(maxlen=TASK_HISTORY))
     next_task_id: int = 1
 
     def log(self, msg: str) -> None:
         ts = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-        line = f"{ts} {msg}"
-        self.logs.append(line)
-        if len(self.logs) > 4000:
-            self.logs = self.logs[-2000:]
+        self.logs.append(f"{ts} {msg}")
 
 STATE = UULState()
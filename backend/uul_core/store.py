@@ -0,0 +1,138 @@
+from __future__ import annotations
+import os
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from .state import Task, RoomState
+
+# SQLite (WAL) write-through store for the task bus and room states.
+# The in-memory indexes in STATE stay the fast path; every transition is
+# also written here so a restart replays the bus, and the database is the
+# arbiter when several server processes share it (a dispatch only counts if
+# its queued->running UPDATE wins).
+DB_PATH = os.getenv("UUL_STATE_DB", os.path.join(os.path.dirname(os.path.dirname(__file__)), "uul_state.sqlite3"))
+
+_LOCAL = threading.local()
+_SCHEMA_LOCK = threading.Lock()
+_SCHEMA_READY = set()
+
+_COLS = "id, created_at, status, task_type, payload_json, result_json, error_text, runner_id"
+
+def _init_schema(conn: sqlite3.Connection) -> None:
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        task_type TEXT NOT NULL,
+        payload_json TEXT NOT NULL,
+        result_json TEXT,
+        error_text TEXT,
+        runner_id TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_uul_tasks_status ON tasks(status, id);
+    CREATE TABLE IF NOT EXISTS rooms (
+        name TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        updated_at INTEGER NOT NULL,
+        last_error TEXT NOT NULL DEFAULT ''
+    );
+    """)
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(rooms)")}
+    for col in ("started_at", "finished_at"):
+        if col not in cols:
+            conn.execute(f"ALTER TABLE rooms ADD COLUMN {col} REAL")
+    conn.commit()
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, timeout=30, cached_statements=64)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA busy_timeout=30000;")
+    key = (os.getpid(), DB_PATH)
+    if key not in _SCHEMA_READY:
+        with _SCHEMA_LOCK:
+            if key not in _SCHEMA_READY:
+                _init_schema(conn)
+                _SCHEMA_READY.add(key)
+    return conn
+
+def _db() -> sqlite3.Connection:
+    key = (os.getpid(), DB_PATH)
+    if getattr(_LOCAL, "key", None) != key:
+        _LOCAL.conn = _connect()
+        _LOCAL.key = key
+    return _LOCAL.conn
+
+def _row_to_task(row) -> Task:
+    return Task(
+        id=row[0],
+        created_at=row[1],
+        status=row[2],
+        task_type=row[3],
+        payload=json.loads(row[4]) if row[4] else {},
+        result=json.loads(row[5]) if row[5] else None,
+        error=row[6],
+        runner_id=row[7],
+    )
+
+def insert_task(created_at: int, task_type: str, payload: Dict[str, Any]) -> int:
+    conn = _db()
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO tasks(created_at, status, task_type, payload_json) VALUES(?, 'queued', ?, ?)",
+            (created_at, task_type, json.dumps(payload, ensure_ascii=True)),
+        )
+    return int(cur.lastrowid)
+
+def claim_task(tid: int, runner_id: str) -> bool:
+    # False when another process dispatched (or finished) it first
+    conn = _db()
+    with conn:
+        cur = conn.execute(
+            "UPDATE tasks SET status='running', runner_id=? WHERE id=? AND status='queued'",
+            (runner_id, tid),
+        )
+    return cur.rowcount == 1
+
+def finish_task(tid: int, status: str, result: Optional[Dict[str, Any]], error: Optional[str]) -> bool:
+    conn = _db()
+    with conn:
+        cur = conn.execute(
+            "UPDATE tasks SET status=?, result_json=?, error_text=? WHERE id=? AND status IN ('queued','running')",
+            (status, json.dumps(result, ensure_ascii=True) if result is not None else None, error, tid),
+        )
+    return cur.rowcount == 1
+
+def queued_after(after_id: int) -> List[Task]:
+    # tasks other processes submitted since we last looked
+    rows = _db().execute(
+        f"SELECT {_COLS} FROM tasks WHERE status='queued' AND id > ? ORDER BY id", (after_id,),
+    ).fetchall()
+    return [_row_to_task(r) for r in rows]
+
+def load(history: int) -> Tuple[List[Task], List[Task]]:
+    # (live tasks oldest first, last `history` tasks oldest first)
+    conn = _db()
+    live = [_row_to_task(r) for r in conn.execute(
+        f"SELECT {_COLS} FROM tasks WHERE status IN ('queued','running') ORDER BY id").fetchall()]
+    recent = [_row_to_task(r) for r in conn.execute(
+        f"SELECT {_COLS} FROM tasks ORDER BY id DESC LIMIT ?", (int(history),)).fetchall()]
+    recent.reverse()
+    return live, recent
+
+def save_room(rs: RoomState) -> None:
+    conn = _db()
+    with conn:
+        conn.execute(
+            "INSERT INTO rooms(name, status, updated_at, last_error, started_at, finished_at) VALUES(?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET status=excluded.status, updated_at=excluded.updated_at, "
+            "last_error=excluded.last_error, started_at=excluded.started_at, finished_at=excluded.finished_at",
+            (rs.name, rs.status, rs.updated_at, rs.last_error, rs.started_at, rs.finished_at),
+        )
+
+def load_rooms() -> List[RoomState]:
+    rows = _db().execute("SELECT name, status, updated_at, last_error, started_at, finished_at FROM rooms").fetchall()
+    return [RoomState(name=r[0], status=r[1], updated_at=r[2], last_error=r[3], started_at=r[4], finished_at=r[5])
+            for r in rows]
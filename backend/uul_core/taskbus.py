@@ -1,40 +1,178 @@
 from __future__ import annotations
-from typing import Any, Dict, Optional
-from .state import STATE, Task, now_ts
+import asyncio
+from itertools import islice
+from typing import Any, Dict, List, Optional
+from .state import STATE, Task, TASK_HISTORY, now_ts
+from . import store
+
+# submits handled by other server processes only show up in the store, so
+# long-polls re-check it this often
+RECHECK_SEC = 1.0
+# highest task id pulled from the store
+_SEEN = 0
+
+# Long-poll support: waiters park on an asyncio.Event that submit() sets and
+# replaces, so idle runners wake as soon as there is work instead of polling.
+_EVENT: Optional[asyncio.Event] = None
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+def _wake() -> None:
+    global _EVENT
+    ev, loop = _EVENT, _LOOP
+    if ev is None or loop is None or loop.is_closed():
+        return
+    _EVENT = None
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        ev.set()
+    else:
+        loop.call_soon_threadsafe(ev.set)
+
+def replay() -> int:
+    # rebuild the in-memory bus from the store; only live tasks and the
+    # history window are read, so startup cost does not grow with the backlog
+    global _SEEN
+    live, hist = store.load(TASK_HISTORY)
+    STATE.tasks.clear()
+    STATE.queue.clear()
+    STATE.history.clear()
+    by_id = {t.id: t for t in hist}
+    for t in live:
+        t = by_id.get(t.id, t)
+        STATE.tasks[t.id] = t
+        if t.status == "queued":
+            STATE.queue.append(t.id)
+    STATE.history.extend(hist)
+    for rs in store.load_rooms():
+        STATE.rooms[rs.name] = rs
+    top = max([t.id for t in hist[-1:]] + [t.id for t in live[-1:]] + [0])
+    _SEEN = top
+    STATE.next_task_id = top + 1
+    return len(live)
+
+def _pull(rows: Optional[List[Task]] = None) -> None:
+    # rows: a store.queued_after(_SEEN) result fetched off the event loop
+    global _SEEN
+    for t in store.queued_after(_SEEN) if rows is None else rows:
+        _SEEN = max(_SEEN, t.id)
+        if t.id not in STATE.tasks:
+            STATE.tasks[t.id] = t
+            STATE.queue.append(t.id)
+            STATE.history.append(t)
 
 def submit(task_type: str, payload: Dict[str, Any]) -> int:
-    tid = STATE.next_task_id
-    STATE.next_task_id += 1
+    created_at = now_ts()
+    tid = store.insert_task(created_at, task_type, payload)
+    return _enqueue(tid, created_at, task_type, payload)
+
+async def submit_async(task_type: str, payload: Dict[str, Any]) -> int:
+    # submit() with the SQLite write in a worker thread
+    created_at = now_ts()
+    tid = await asyncio.to_thread(store.insert_task, created_at, task_type, payload)
+    return _enqueue(tid, created_at, task_type, payload)
+
+def _enqueue(tid: int, created_at: int, task_type: str, payload: Dict[str, Any]) -> int:
+    STATE.next_task_id = max(STATE.next_task_id, tid + 1)
     t = Task(
         id=tid,
-        created_at=now_ts(),
+        created_at=created_at,
         status="queued",
         task_type=task_type,
         payload=payload,
     )
-    STATE.tasks.append(t)
+    STATE.tasks[tid] = t
+    STATE.queue.append(tid)
+    STATE.history.append(t)
     STATE.log(f"[taskbus] submitted id={tid} type={task_type}")
+    _wake()
     return tid
 
-def next_task(runner_id: str) -> Optional[Task]:
-    # find first queued
-    for t in STATE.tasks:
-        if t.status == "queued":
-            t.status = "running"
-            t.runner_id = runner_id
-            STATE.log(f"[taskbus] dispatch id={t.id} runner={runner_id}")
+def _dispatch(t: Task, runner_id: str, claimed: bool) -> bool:
+    if not claimed:
+        # another process got it first
+        STATE.tasks.pop(t.id, None)
+        t.status = "running"
+        return False
+    t.status = "running"
+    t.runner_id = runner_id
+    STATE.log(f"[taskbus] dispatch id={t.id} runner={runner_id}")
+    return True
+
+def _pop_queued() -> Optional[Task]:
+    while STATE.queue:
+        t = STATE.tasks.get(STATE.queue.popleft())
+        if t is not None and t.status == "queued":
             return t
     return None
 
+def next_task(runner_id: str) -> Optional[Task]:
+    # oldest queued; the store decides races with other processes
+    if not STATE.queue:
+        _pull()
+    while True:
+        t = _pop_queued()
+        if t is None:
+            return None
+        if _dispatch(t, runner_id, store.claim_task(t.id, runner_id)):
+            return t
+
+async def _next_task_async(runner_id: str) -> Optional[Task]:
+    # next_task() with the SQLite calls in a worker thread, so a busy store
+    # never stalls the event loop. The store is only read while nothing is
+    # queued in memory, and only written when there is a task to claim.
+    if not STATE.queue:
+        _pull(await asyncio.to_thread(store.queued_after, _SEEN))
+    while True:
+        t = _pop_queued()
+        if t is None:
+            return None
+        if _dispatch(t, runner_id, await asyncio.to_thread(store.claim_task, t.id, runner_id)):
+            return t
+
+async def wait_task(runner_id: str, timeout: float) -> Optional[Task]:
+    # next_task(), but wait up to `timeout` seconds for a submit if none is queued
+    global _EVENT, _LOOP
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max(0.0, timeout)
+    while True:
+        t = await _next_task_async(runner_id)
+        left = deadline - loop.time()
+        if t is not None or left <= 0:
+            return t
+        if _EVENT is None or _LOOP is not loop:
+            _EVENT, _LOOP = asyncio.Event(), loop
+        try:
+            await asyncio.wait_for(_EVENT.wait(), min(left, RECHECK_SEC))
+        except asyncio.TimeoutError:
+            pass
+
 def report(task_id: int, ok: bool, result: Dict[str, Any] | None = None, error: str | None = None) -> bool:
-    for t in STATE.tasks:
-        if t.id == task_id:
-            t.status = "done" if ok else "error"
-            t.result = result
-            t.error = error
-            STATE.log(f"[taskbus] report id={task_id} status={t.status}")
-            return True
-    return False
+    # the task may have been dispatched by another process: the store is authoritative
+    status = "done" if ok else "error"
+    return _finished(task_id, store.finish_task(task_id, status, result, error), status, result, error)
+
+async def report_async(task_id: int, ok: bool, result: Dict[str, Any] | None = None, error: str | None = None) -> bool:
+    # report() with the SQLite write in a worker thread
+    status = "done" if ok else "error"
+    stored = await asyncio.to_thread(store.finish_task, task_id, status, result, error)
+    return _finished(task_id, stored, status, result, error)
+
+def _finished(task_id: int, stored: bool, status: str, result: Dict[str, Any] | None, error: str | None) -> bool:
+    if not stored:
+        STATE.tasks.pop(task_id, None)
+        return False
+    t = STATE.tasks.pop(task_id, None)
+    if t is not None:
+        t.status = status
+        t.result = result
+        t.error = error
+    STATE.log(f"[taskbus] report id={task_id} status={status}")
+    return True
 
 def recent(limit: int = 20):
-    return list(reversed(STATE.tasks))[:max(1, min(200, limit))]
+    return list(islice(reversed(STATE.history), max(1, min(200, limit))))
+
+replay()
@@ -1,56 +1,127 @@
-import os, sys, json, subprocess, time
+import os, sys, json, subprocess, time, hashlib
 from datetime import datetime, timezone
 
+from queue_segments import append
+
 ROOT=os.path.expanduser("~/station_root")
 Q=os.path.join(ROOT,"station_meta/queue/tasks.jsonl")
+# path -> content hash as of the last time it was enqueued
+STATE=os.path.join(ROOT,"station_meta/queue/diff_state.json")
+QDIR=os.path.dirname(Q)
 
 def utc(): return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
-def sh(cmd):
-    p=subprocess.Popen(cmd, shell=True, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    out=p.communicate()[0] or ""
-    return p.returncode, out
+def changed_paths():
+    # changed files since last commit (staged+unstaged+untracked). git is run
+    # with argv, not through a shell; -z keeps paths unquoted and gives a
+    # rename/copy its source path as a separate field, which we list too
+    p=subprocess.run(["git","status","--porcelain","-z"], cwd=ROOT, capture_output=True, text=True)
+    fields=p.stdout.split("\0")
+    out=[]
+    i=0
+    while i<len(fields):
+        ent=fields[i]
+        i+=1
+        if len(ent)<4:
+            continue
+        out.append(ent[3:])
+        if ent[0] in "RC" and i<len(fields):
+            out.append(fields[i])
+            i+=1
+    return out
+
+def route(path):
+    if path.startswith("specs/") or path.startswith("station_meta/tree") or path.startswith("station_meta/bindings"):
+        return "R1","bootstrap_validate"
+    if path.startswith("backend/"):
+        return "R2","termux_env_prepare_backend"
+    if path.startswith("frontend/"):
+        return "R4","frontend_build_check"
+    return "R5","stage_only"
+
+def file_hash(full):
+    h=hashlib.sha1()
+    with open(full,"rb") as f:
+        for chunk in iter(lambda: f.read(1<<16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def content_hash(path):
+    # file bytes; untracked dirs ("x/") hash their files' names and hashes
+    # (None when the queue files are all they hold); deleted -> "-"
+    full=os.path.join(ROOT,path.rstrip("/"))
+    try:
+        if os.path.islink(full):
+            return "l:"+os.readlink(full)
+        if not os.path.isdir(full):
+            return file_hash(full)
+        h=hashlib.sha1()
+        n=0
+        for d,dirs,files in os.walk(full):
+            # our own queue files live in the tree; never count them
+            dirs[:]=sorted(x for x in dirs if os.path.join(d,x)!=QDIR)
+            for fn in sorted(files):
+                fp=os.path.join(d,fn)
+                h.update(os.path.relpath(fp,full).encode()+b"\0")
+                h.update((file_hash(fp) if not os.path.islink(fp) else os.readlink(fp)).encode()+b"\0")
+                n+=1
+        return h.hexdigest() if n else None
+    except FileNotFoundError:
+        return "-"
+    except OSError:
+        return "?"
+
+def load_state():
+    try:
+        with open(STATE,"r",encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def save_state(st):
+    tmp=STATE+".tmp"
+    with open(tmp,"w",encoding="utf-8") as f:
+        json.dump(st,f,ensure_ascii=False,sort_keys=True)
+    os.replace(tmp,STATE)
 
 def main():
+    # incremental by default: a path is enqueued only when its content differs
+    # from what was last enqueued; --full re-enqueues every changed path
+    full="--full" in sys.argv[1:]
     os.makedirs(os.path.dirname(Q), exist_ok=True)
 
-    # changed files since last commit (staged+unstaged)
-    _, out = sh("git status --porcelain")
-    lines=[ln.strip() for ln in out.splitlines() if ln.strip()]
-    if not lines:
-        print(">>> [diff_to_queue] no changes -> no tasks")
+    qrel=os.path.relpath(QDIR,ROOT)+"/"
+    paths=[p for p in changed_paths() if not (p.rstrip("/")+"/").startswith(qrel)]
+    prev={} if full else load_state()
+    # paths that went clean drop out, so changing them again re-triggers
+    cur={p: h for p in paths for h in [content_hash(p)] if h is not None}
+    paths=[p for p in paths if p in cur]
+    fresh=[p for p in paths if prev.get(p)!=cur[p]]
+    if not fresh:
+        save_state(cur)
+        print(f">>> [diff_to_queue] no new changes (changed={len(paths)}) -> no tasks")
         return
 
-    # categorize into rooms
-    tasks=[]
-    for ln in lines:
-        path=ln[3:] if len(ln)>3 else ln
-        room="R5"
-        pipeline="stage_only"
-
-        if path.startswith("specs/") or path.startswith("station_meta/tree") or path.startswith("station_meta/bindings"):
-            room="R1"; pipeline="bootstrap_validate"
-        elif path.startswith("backend/"):
-            room="R2"; pipeline="termux_env_prepare_backend"
-        elif path.startswith("frontend/"):
-            room="R4"; pipeline="frontend_build_check"
-        elif path.startswith("scripts/"):
-            room="R5"; pipeline="stage_only"
-
-        tasks.append({
-            "ts": utc(),
-            "room": room,
-            "pipeline": pipeline,
-            "path": path,
-            "status": "queued"
-        })
-
-    # append tasks
-    with open(Q,"a",encoding="utf-8") as f:
-        for t in tasks:
-            f.write(json.dumps(t, ensure_ascii=False)+"\n")
-
-    print(f">>> [diff_to_queue] queued={len(tasks)} -> {Q}")
+    # coalesce into one task per (room, pipeline)
+    groups={}
+    for path in fresh:
+        groups.setdefault(route(path),[]).append(path)
+    ts=utc()
+    tasks=[{
+        "ts": ts,
+        "room": room,
+        "pipeline": pipeline,
+        "path": group[0],
+        "paths": group,
+        "status": "queued"
+    } for (room,pipeline),group in sorted(groups.items())]
+
+    # append tasks (rotation-safe writer)
+    for t in tasks:
+        append(Q, t)
+    save_state(cur)
+
+    print(f">>> [diff_to_queue] queued={len(tasks)} paths={len(fresh)} skipped={len(paths)-len(fresh)} -> {Q}")
 
 if __name__=="__main__":
     main()
@@ -1,18 +1,26 @@
-import json, os, sys, time, subprocess, hashlib
+import json, os, sys, time, subprocess, hashlib, glob, fcntl, threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timezone
 
 ROOT_DIR = os.path.expanduser("~/station_root")
 
+sys.path.insert(0, os.path.join(ROOT_DIR, "backend"))
+from app.core import filelock  # shared flock-based locks
+
 def utc_now():
     return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
-def sh(cmd: str) -> tuple[int, str]:
+_PRINT_LOCK = threading.Lock()
+
+def sh(cmd: str, prefix: str = "") -> tuple[int, str]:
+    # prefix tags each echoed line when several steps run at once
     p = subprocess.Popen(cmd, shell=True, cwd=ROOT_DIR,
                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
     out=[]
     for line in p.stdout:
         out.append(line)
-        print(line, end="")
+        with _PRINT_LOCK:
+            print(prefix + line, end="")
     p.wait()
     return p.returncode, "".join(out)
 
@@ -23,75 +31,211 @@ def read_json(path: str):
 def write_event(event_path: str, e: dict):
     full = os.path.join(ROOT_DIR, event_path)
     os.makedirs(os.path.dirname(full), exist_ok=True)
-    with open(full, "a", encoding="utf-8") as f:
+    with _PRINT_LOCK, open(full, "a", encoding="utf-8") as f:
         f.write(json.dumps(e, ensure_ascii=False) + "\n")
 
 def lock_path(lock_dir: str, name: str) -> str:
     return os.path.join(ROOT_DIR, lock_dir, f"{name}.lock.json")
 
-def acquire_lock(lock_dir: str, name: str, owner: str, lease_seconds: int) -> None:
-    os.makedirs(os.path.join(ROOT_DIR, lock_dir), exist_ok=True)
-    lp = lock_path(lock_dir, name)
-    now = int(time.time())
-    if os.path.exists(lp):
-        data = json.load(open(lp, "r", encoding="utf-8"))
-        exp = data.get("acquired_at", 0) + data.get("lease_seconds", 0)
-        if now < exp:
-            raise RuntimeError(f"LOCK_BUSY:{name}:owned_by={data.get('owner')} until={exp}")
-    data = {"name": name, "owner": owner, "acquired_at": now, "lease_seconds": lease_seconds}
-    with open(lp, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def acquire_lock(lock_dir: str, name: str, owner: str, lease_seconds: int, timeout: float = 0) -> None:
+    # kernel flock; raises LockBusy (a RuntimeError, "LOCK_BUSY:...") if not had within timeout
+    filelock.acquire(lock_path(lock_dir, name), owner, lease_seconds, timeout, name=name)
 
 def release_lock(lock_dir: str, name: str, owner: str) -> None:
-    lp = lock_path(lock_dir, name)
-    if not os.path.exists(lp):
-        return
-    data = json.load(open(lp, "r", encoding="utf-8"))
-    if data.get("owner") != owner:
-        raise RuntimeError(f"LOCK_OWNER_MISMATCH:{name}")
-    os.remove(lp)
+    filelock.release(lock_path(lock_dir, name), owner)
 
-def sha256_text(s: str) -> str:
-    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+# ---- lock sets ----
+# Each step runs under its own lock set: step "locks", else the pipeline's
+# entry in "pipeline_locks", else "default_locks" (the old four). Sets are
+# taken in one canonical order ("lock_order", then by name) and held only
+# while the step runs, so pipelines with disjoint sets run side by side.
 
-def run_pipeline(cfg: dict, pipeline_name: str, mode: str, root_id: int):
-    event_log = cfg["event_log"]
+LEGACY_LOCKS = ["tree", "bindings", "env", "stage"]
+
+def step_locks(cfg: dict, pipeline_name: str, step: dict) -> list:
+    if "locks" in step:
+        names = step["locks"]
+    else:
+        names = cfg.get("pipeline_locks", {}).get(pipeline_name, cfg.get("default_locks", LEGACY_LOCKS))
+    order = {n: i for i, n in enumerate(cfg.get("lock_order", []))}
+    return sorted(set(names), key=lambda n: (order.get(n, len(order)), n))
+
+def acquire_locks(cfg: dict, names: list, owner: str) -> list:
+    # all or nothing; waits up to lock_wait_seconds for the whole set
     lock_dir = cfg["lock_dir"]
     lease = int(cfg["lease_seconds"])
-    owner = f"dynamo::{mode}::R{root_id}"
+    deadline = time.monotonic() + float(cfg.get("lock_wait_seconds", 30))
+    held = []
+    try:
+        for ln in names:
+            acquire_lock(lock_dir, ln, owner, lease, max(0.0, deadline - time.monotonic()))
+            held.append(ln)
+    except Exception:
+        release_locks(cfg, held, owner)
+        raise
+    return held
 
-    locks = ["tree", "bindings", "env", "stage"]
-    for ln in locks:
-        acquire_lock(lock_dir, ln, owner, lease)
+def release_locks(cfg: dict, names: list, owner: str) -> None:
+    for ln in reversed(names):
+        try:
+            release_lock(cfg["lock_dir"], ln, owner)
+        except Exception:
+            pass
 
-    try:
-        steps = cfg["pipelines"].get(pipeline_name, [])
-        if not steps:
-            raise RuntimeError(f"PIPELINE_NOT_FOUND:{pipeline_name}")
+def sha256_text(s: str) -> str:
+    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+# ---- step cache ----
+# A step with "inputs" globs is skipped when the hash of its command and input
+# files matches its last successful run and every "outputs" glob still matches.
 
-        for i, step in enumerate(steps, start=1):
-            e_start = {"ts": utc_now(), "mode": mode, "root_id": root_id,
-                       "pipeline": pipeline_name, "step_index": i,
-                       "step_name": step["name"], "status": "started", "cmd": step["cmd"]}
-            write_event(event_log, e_start)
+def cache_path(cfg: dict) -> str:
+    return os.path.join(ROOT_DIR, cfg.get("step_cache", "station_meta/dynamo/step_cache.json"))
 
-            rc, out = sh(step["cmd"])
+def expand(globs: list) -> list:
+    out = set()
+    for g in globs or []:
+        for p in glob.glob(os.path.join(ROOT_DIR, g), recursive=True):
+            if os.path.isfile(p):
+                out.add(os.path.relpath(p, ROOT_DIR))
+    return sorted(out)
 
-            e_end = {"ts": utc_now(), "mode": mode, "root_id": root_id,
-                     "pipeline": pipeline_name, "step_index": i,
-                     "step_name": step["name"], "status": "succeeded" if rc == 0 else "failed",
-                     "rc": rc, "out_sha256": sha256_text(out[-2000:])}
-            write_event(event_log, e_end)
+def inputs_sha(step: dict) -> str:
+    h = hashlib.sha256(step["cmd"].encode("utf-8") + b"\0")
+    for rel in expand(step.get("inputs")):
+        h.update(rel.encode("utf-8") + b"\0")
+        with open(os.path.join(ROOT_DIR, rel), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                h.update(chunk)
+        h.update(b"\0")
+    return h.hexdigest()
 
-            if rc != 0:
-                raise RuntimeError(f"STEP_FAILED:{pipeline_name}:{step['name']}")
+def outputs_present(step: dict) -> bool:
+    return all(glob.glob(os.path.join(ROOT_DIR, g), recursive=True) for g in step.get("outputs") or [])
 
+def _cache_update(cfg: dict, fn):
+    # read-modify-write under an flock so concurrent dynamo runs don't clobber it
+    cp = cache_path(cfg)
+    os.makedirs(os.path.dirname(cp), exist_ok=True)
+    with open(cp + ".lock", "a") as lk:
+        fcntl.flock(lk, fcntl.LOCK_EX)
+        try:
+            data = json.load(open(cp, "r", encoding="utf-8"))
+        except Exception:
+            data = {}
+        out = fn(data)
+        if out is not None:
+            tmp = cp + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(out, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, cp)
+    return data
+
+def cache_lookup(cfg: dict, key: str):
+    return _cache_update(cfg, lambda d: None).get(key)
+
+def cache_store(cfg: dict, key: str, sha: str) -> None:
+    def put(d):
+        d[key] = {"inputs_sha256": sha, "ts": utc_now()}
+        return d
+    _cache_update(cfg, put)
+
+# ---- pipelines ----
+
+def step_needs(steps: list) -> dict:
+    # "needs": [names] runs a step once those succeeded ([] = right away);
+    # steps without it keep the old behaviour and wait for the previous step
+    names = [s["name"] for s in steps]
+    needs = {}
+    for i, s in enumerate(steps):
+        deps = s.get("needs")
+        if deps is None:
+            deps = [names[i - 1]] if i else []
+        unknown = [d for d in deps if d not in names]
+        if unknown:
+            raise RuntimeError(f"STEP_NEEDS_UNKNOWN:{s['name']}:{','.join(unknown)}")
+        needs[s["name"]] = set(deps)
+    return needs
+
+def run_step(cfg: dict, pipeline_name: str, mode: str, root_id: int, i: int, step: dict, tag: str) -> bool:
+    event_log = cfg["event_log"]
+    base = {"mode": mode, "root_id": root_id, "pipeline": pipeline_name,
+            "step_index": i, "step_name": step["name"]}
+    key = f"{pipeline_name}:{step['name']}"
+    sha = None
+    if step.get("inputs") and step.get("cache", True):
+        sha = inputs_sha(step)
+        hit = cache_lookup(cfg, key)
+        if hit and hit.get("inputs_sha256") == sha and outputs_present(step):
+            write_event(event_log, {"ts": utc_now(), **base, "status": "cached",
+                                    "cache": "hit", "inputs_sha256": sha, "cached_at": hit.get("ts")})
+            with _PRINT_LOCK:
+                print(f">>> [DYNAMO] {step['name']} cache hit")
+            return True
+
+    owner = f"dynamo::{mode}::R{root_id}::{pipeline_name}:{step['name']}"
+    held = acquire_locks(cfg, step_locks(cfg, pipeline_name, step), owner)
+    try:
+        write_event(event_log, {"ts": utc_now(), **base, "status": "started", "cmd": step["cmd"], "locks": held})
+        rc, out = sh(step["cmd"], tag)
     finally:
-        for ln in reversed(locks):
-            try:
-                release_lock(lock_dir, ln, owner)
-            except Exception:
-                pass
+        release_locks(cfg, held, owner)
+    e_end = {"ts": utc_now(), **base, "status": "succeeded" if rc == 0 else "failed",
+             "rc": rc, "out_sha256": sha256_text(out[-2000:])}
+    if sha is not None:
+        e_end["cache"] = "miss"
+    write_event(event_log, e_end)
+    if rc == 0 and sha is not None:
+        cache_store(cfg, key, sha)
+    return rc == 0
+
+def run_pipeline(cfg: dict, pipeline_name: str, mode: str, root_id: int):
+    # locks are taken per step (see run_step), never for the whole pipeline
+    steps = cfg["pipelines"].get(pipeline_name, [])
+    if not steps:
+        raise RuntimeError(f"PIPELINE_NOT_FOUND:{pipeline_name}")
+
+    # run every step whose needs are met, up to max_parallel_steps at once
+    needs = step_needs(steps)
+    index = {s["name"]: (i, s) for i, s in enumerate(steps, start=1)}
+    pending = [s["name"] for s in steps]
+    failed = []
+    workers = max(1, int(cfg.get("max_parallel_steps", 4)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while True:
+            if not failed:
+                for name in [n for n in pending if not needs[n]]:
+                    pending.remove(name)
+                    i, step = index[name]
+                    tag = f"[{name}] " if len(steps) > 1 else ""
+                    running[pool.submit(run_step, cfg, pipeline_name, mode, root_id, i, step, tag)] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut)
+                try:
+                    ok = fut.result()
+                except Exception as e:
+                    with _PRINT_LOCK:
+                        print(f">>> [DYNAMO] {name} error: {e}")
+                    ok = False
+                if not ok:
+                    failed.append(name)
+                    continue
+                for n in pending:
+                    needs[n].discard(name)
+
+    if pending and not failed:
+        raise RuntimeError(f"STEP_NEEDS_CYCLE:{pipeline_name}:{','.join(pending)}")
+    for name in pending:
+        i, step = index[name]
+        write_event(cfg["event_log"], {"ts": utc_now(), "mode": mode, "root_id": root_id,
+                                       "pipeline": pipeline_name, "step_index": i,
+                                       "step_name": name, "status": "skipped"})
+    if failed:
+        raise RuntimeError(f"STEP_FAILED:{pipeline_name}:{failed[0]}")
 
 def main():
     if len(sys.argv) < 3:
@@ -1,9 +1,12 @@
-import os, json, time
+import os, sys, time
 from datetime import datetime, timezone
 
 ROOT=os.path.expanduser("~/station_root")
 LOCK_DIR=os.path.join(ROOT,"station_meta","locks")
 
+sys.path.insert(0, os.path.join(ROOT,"backend"))
+from app.core import filelock
+
 def utc(): return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
 def main():
@@ -12,26 +15,29 @@ def main():
         return
     now=int(time.time())
     removed=0
+    overdue=0
     for fn in os.listdir(LOCK_DIR):
         if not fn.endswith(".lock.json"): 
             continue
         path=os.path.join(LOCK_DIR,fn)
+        # locks are kernel flocks: a live holder keeps its lock even past the
+        # lease, and a dead one has already lost it, so only free files go
+        lk=filelock.FileLock(path)
         try:
-            data=json.load(open(path,"r",encoding="utf-8"))
-            acquired=int(data.get("acquired_at",0))
-            lease=int(data.get("lease_seconds",0))
-            exp=acquired+lease
-            if lease>0 and now>exp+5:
-                os.remove(path)
-                removed+=1
-        except Exception:
-            # corrupted lock -> remove
+            if not lk.acquire("lock_cleaner"):
+                data=filelock.read_meta(path)
+                if int(data.get("lease_seconds",0) or 0)>0 and now>int(data.get("acquired_at",0))+int(data["lease_seconds"])+5:
+                    overdue+=1
+                    print(f">>> [lock_cleaner] overdue {fn} owner={data.get('owner')} pid={data.get('pid')}")
+                continue
             try:
                 os.remove(path)
                 removed+=1
-            except Exception:
-                pass
-    print(f">>> [lock_cleaner] removed={removed} ts={utc()}")
+            finally:
+                lk.release()
+        except Exception:
+            pass
+    print(f">>> [lock_cleaner] removed={removed} overdue={overdue} ts={utc()}")
 
 if __name__=="__main__":
     main()
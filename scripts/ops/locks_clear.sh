@@ -5,5 +5,7 @@ LD="$ROOT/station_meta/locks"
 mkdir -p "$LD"
 echo ">>> [locks_clear] removing lock files in $LD"
 ls -1 "$LD" 2>/dev/null || true
-rm -f "$LD"/*.lock.json 2>/dev/null || true
+# held locks are kernel flocks: deleting their files would let a second owner
+# in, so only free lock files are removed (a dead holder's lock is already free)
+python3 "$ROOT/scripts/ops/lock_cleaner.py"
 echo ">>> [locks_clear] done"
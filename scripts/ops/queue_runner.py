@@ -1,6 +1,8 @@
-import os, json, time, subprocess
+import os, subprocess
 from datetime import datetime, timezone
 
+from queue_segments import load_live, append, maybe_rotate
+
 ROOT=os.path.expanduser("~/station_root")
 Q=os.path.join(ROOT,"station_meta/queue/tasks.jsonl")
 PROCESSED=os.path.join(ROOT,"station_meta/queue/processed.jsonl")
@@ -12,24 +14,8 @@ def sh(cmd):
     p.wait()
     return p.returncode
 
-def load_lines(path):
-    if not os.path.exists(path): return []
-    out=[]
-    with open(path,"r",encoding="utf-8") as f:
-        for ln in f:
-            ln=ln.strip()
-            if not ln: continue
-            try: out.append(json.loads(ln))
-            except: pass
-    return out
-
-def append(path,obj):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path,"a",encoding="utf-8") as f:
-        f.write(json.dumps(obj, ensure_ascii=False)+"\n")
-
 def main():
-    tasks=load_lines(Q)
+    tasks=load_live(Q)
     if not tasks:
         print(">>> [queue_runner] empty queue")
         return
@@ -60,7 +46,9 @@ def main():
             it2["run_rc"]=rc2
             it2["status"]="done" if rc2==0 else "failed"
             append(PROCESSED, it2)
+            append(Q, it2)  # status transition; the live segment folds it
 
+    maybe_rotate()
     print(">>> [queue_runner] DONE")
 
 if __name__=="__main__":
@@ -1,28 +1,20 @@
-import os, json, time, threading, subprocess
+import os, sys, json, time, subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timezone
 
+from queue_segments import load_live, append, maybe_rotate, record_key
+import dynamo
+
 ROOT=os.path.expanduser("~/station_root")
 Q=os.path.join(ROOT,"station_meta/queue/tasks.jsonl")
 PROCESSED=os.path.join(ROOT,"station_meta/queue/processed.jsonl")
 ROOMS=os.path.join(ROOT,"station_meta/concurrency/rooms.json")
+DYNAMO_CFG="station_meta/dynamo/dynamo_config.json"
 
-def utc(): return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+sys.path.insert(0, os.path.join(ROOT,"scripts","rooms"))
+import room_runner
 
-def load_lines(path):
-    if not os.path.exists(path): return []
-    out=[]
-    with open(path,"r",encoding="utf-8") as f:
-        for ln in f:
-            ln=ln.strip()
-            if not ln: continue
-            try: out.append(json.loads(ln))
-            except: pass
-    return out
-
-def append(path,obj):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path,"a",encoding="utf-8") as f:
-        f.write(json.dumps(obj, ensure_ascii=False)+"\n")
+def utc(): return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
 def sh(cmd):
     p=subprocess.Popen(cmd, shell=True, cwd=ROOT)
@@ -37,11 +29,26 @@ def map_task_to_room_key(t):
     if room=="R4": return "R4_FRONTEND"
     return "R5_OPS"
 
-def worker(job, results):
+def run_inproc(mode, pipeline, root_id):
+    # what `st.sh dynamo start` does, without the bash + python startups
+    cfg=dynamo.read_json(DYNAMO_CFG)
+    if mode not in cfg["modes"]:
+        print(f">>> [queue_runner_v2] invalid mode: {mode}")
+        return 2
+    try:
+        dynamo.run_pipeline(cfg, pipeline, mode, root_id)
+    except Exception as e:
+        print(f">>> [queue_runner_v2] {pipeline} R{root_id}: {e}")
+        return 1
+    return 0
+
+def worker(job):
     room_key, mode, pipeline, root_id, items = job
-    cmd=f"python scripts/rooms/room_runner.py --mode {mode} --room {room_key} --pipeline {pipeline} --root {root_id}"
-    rc=sh(cmd)
-    results.append((job, rc))
+    try:
+        rc=room_runner.run_room(room_key, mode, pipeline, root_id, run=run_inproc)
+    except Exception as e:
+        print(f">>> [queue_runner_v2] {room_key} {pipeline}: {e}")
+        rc=1
 
     for it in items:
         it2=dict(it)
@@ -49,52 +56,92 @@ def worker(job, results):
         it2["status"]="done" if rc==0 else "failed"
         it2["run_rc"]=rc
         append(PROCESSED, it2)
+        append(Q, it2)  # status transition; the live segment folds it
+    return rc
 
-def main():
-    mode=os.environ.get("ST_MODE","PROD")
-    tasks=load_lines(Q)
-    tasks=[t for t in tasks if t.get("status")=="queued"]
-    if not tasks:
-        print(">>> [queue_runner_v2] empty queue")
-        return
-
-    # stop-the-world guard before running anything
-    rcg=sh("bash scripts/guards/guard_ops_gate.sh")
-    if rcg!=0:
-        print(">>> [queue_runner_v2] GUARD FAILED -> stop")
-        return
-
-    rooms_cfg=json.load(open(ROOMS,"r",encoding="utf-8"))
-    maxc=int(rooms_cfg.get("max_concurrency",1))
-
-    # group by (room_key,pipeline)
+def collect_jobs(mode, rooms_cfg, skip):
+    # queued tasks not already taken, grouped by (room_key,pipeline)
     groups={}
-    for t in tasks:
+    for t in load_live(Q):
+        if t.get("status")!="queued" or record_key(t) in skip:
+            continue
         room_key=map_task_to_room_key(t)
         pipeline=t.get("pipeline","stage_only")
         root_id=int(rooms_cfg["rooms"][room_key]["root_id"])
         key=(room_key,pipeline,root_id)
         groups.setdefault(key, []).append(t)
+    return [(rk,mode,pip,rid,items) for (rk,pip,rid), items in groups.items()]
 
-    jobs=[(rk,mode,pip,rid,items) for (rk,pip,rid), items in groups.items()]
-
-    print(f">>> [queue_runner_v2] jobs={len(jobs)} max_concurrency={maxc}")
-
+def serve(mode, daemon=False, poll=2.0):
+    # one pool of max_concurrency workers for the life of the process; the
+    # dynamo engine is imported once and every job runs in-process. One job
+    # per room at a time (the room lock is single-writer anyway).
+    rooms_cfg=json.load(open(ROOMS,"r",encoding="utf-8"))
+    maxc=int(rooms_cfg.get("max_concurrency",1))
+    pool=ThreadPoolExecutor(max_workers=maxc, thread_name_prefix="room")
+    waiting=[]
+    running={}
+    taken=set()
     results=[]
-    threads=[]
-    sem=threading.Semaphore(maxc)
-
-    def wrapped(job):
-        with sem:
-            worker(job, results)
+    first=True
+    try:
+        while True:
+            if daemon or first:
+                jobs=collect_jobs(mode, rooms_cfg, taken)
+                if first and not jobs and not daemon:
+                    print(">>> [queue_runner_v2] empty queue")
+                    return results
+                first=False
+                if jobs:
+                    # stop-the-world guard before running anything new
+                    if sh("bash scripts/guards/guard_ops_gate.sh")!=0:
+                        print(">>> [queue_runner_v2] GUARD FAILED -> stop")
+                        if not daemon:
+                            return results
+                        jobs=[]
+                    else:
+                        print(f">>> [queue_runner_v2] jobs={len(jobs)} max_concurrency={maxc}")
+                    for job in jobs:
+                        taken.update(record_key(t) for t in job[4])
+                        waiting.append(job)
+
+            busy={job[0] for job in running.values()}
+            for job in list(waiting):
+                if job[0] not in busy:
+                    waiting.remove(job)
+                    busy.add(job[0])
+                    running[pool.submit(worker, job)]=job
+
+            if not running:
+                maybe_rotate()
+                if not daemon:
+                    return results
+                time.sleep(poll)
+                continue
+
+            done,_=wait(running, timeout=poll if daemon else None, return_when=FIRST_COMPLETED)
+            for fut in done:
+                job=running.pop(fut)
+                rc=fut.result()
+                results.append((job, rc))
+                # the queue now has their done/failed records
+                taken.difference_update(record_key(t) for t in job[4])
+                if daemon:
+                    print(f">>> [queue_runner_v2] {job[0]} {job[2]} rc={rc}")
+    finally:
+        pool.shutdown(wait=True)
 
-    for job in jobs:
-        th=threading.Thread(target=wrapped, args=(job,), daemon=True)
-        threads.append(th)
-        th.start()
+def main():
+    import argparse
+    ap=argparse.ArgumentParser()
+    ap.add_argument("--daemon", action="store_true", help="keep running and pick up new tasks")
+    ap.add_argument("--poll", type=float, default=float(os.environ.get("ST_QUEUE_POLL","2")))
+    args=ap.parse_args()
+    mode=os.environ.get("ST_MODE","PROD")
 
-    for th in threads:
-        th.join()
+    results=serve(mode, daemon=args.daemon, poll=args.poll)
+    if not results:
+        return
 
     failed=[(j,rc) for (j,rc) in results if rc!=0]
     print(f">>> [queue_runner_v2] done failed={len(failed)}")
@@ -0,0 +1,202 @@
+import os, sys, json, time, fcntl, shutil
+from datetime import datetime, timezone
+
+# Segmented queue logs.
+# Readers only ever open the live file (tasks.jsonl / processed.jsonl).
+# rotate() seals the live file into segments/ and carries still-open records
+# forward, compact() folds sealed segments into one archive segment per log.
+# <live>.manifest.json records what exists on disk.
+
+ROOT=os.path.expanduser("~/station_root")
+QDIR=os.path.join(ROOT,"station_meta/queue")
+SEG_DIR=os.path.join(QDIR,"segments")
+LOGS=[os.path.join(QDIR,"tasks.jsonl"), os.path.join(QDIR,"processed.jsonl")]
+
+MAX_BYTES=int(os.environ.get("ST_QUEUE_SEGMENT_BYTES", str(4*1024*1024)))
+MAX_AGE=int(os.environ.get("ST_QUEUE_SEGMENT_AGE", str(24*3600)))
+
+def utc(): return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def record_key(rec):
+    if rec.get("id"): return str(rec["id"])
+    return "|".join(str(rec.get(k,"")) for k in ("ts","room","pipeline","path"))
+
+def is_terminal(rec):
+    st=rec.get("status")
+    if st=="done": return True
+    if st=="failed":
+        # loop_queue records retry until tries reaches max_retries
+        if "max_retries" in rec:
+            return int(rec.get("tries",0))>=int(rec.get("max_retries",0))
+        return True
+    return False
+
+def read_records(path):
+    if not os.path.exists(path): return []
+    out=[]
+    with open(path,"r",encoding="utf-8") as f:
+        for ln in f:
+            ln=ln.strip()
+            if not ln: continue
+            try: out.append(json.loads(ln))
+            except: pass
+    return out
+
+def fold(records):
+    # newest record per key, in order of first appearance
+    last={}
+    for r in records:
+        if isinstance(r,dict): last[record_key(r)]=r
+    return list(last.values())
+
+def load_live(path):
+    return fold(read_records(path))
+
+# ---------- manifest ----------
+
+def manifest_path(live): return live+".manifest.json"
+
+def load_manifest(live):
+    try:
+        return json.load(open(manifest_path(live),"r",encoding="utf-8"))
+    except Exception:
+        return {"live":os.path.basename(live),"live_created":int(time.time()),"seq":0,
+                "sealed":[],"archive":None,"archived_records":0,"updated_utc":utc()}
+
+def save_manifest(live, m):
+    m["updated_utc"]=utc()
+    tmp=manifest_path(live)+".tmp"
+    with open(tmp,"w",encoding="utf-8") as f:
+        json.dump(m,f,ensure_ascii=False,indent=2)
+    os.replace(tmp, manifest_path(live))
+
+# ---------- writers ----------
+
+def _open_locked(path):
+    # lock the live file; reopen if it was rotated while we waited
+    while True:
+        f=open(path,"a",encoding="utf-8")
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            if os.fstat(f.fileno()).st_ino==os.stat(path).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+def append(path, obj):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    f=_open_locked(path)
+    try:
+        f.write(json.dumps(obj, ensure_ascii=False)+"\n")
+        f.flush()
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+def needs_rotation(live, m=None):
+    try: st=os.stat(live)
+    except FileNotFoundError: return False
+    if st.st_size==0: return False
+    if st.st_size>=MAX_BYTES: return True
+    if m is None:
+        m=load_manifest(live)
+        # start the age clock the first time we see this log
+        if not os.path.exists(manifest_path(live)): save_manifest(live, m)
+    return int(time.time())-int(m.get("live_created",0))>=MAX_AGE
+
+def rotate(live, force=False):
+    if not os.path.exists(live): return None
+    os.makedirs(SEG_DIR, exist_ok=True)
+    f=_open_locked(live)
+    try:
+        m=load_manifest(live)
+        if not force and not needs_rotation(live, m): return None
+        m["seq"]=int(m.get("seq",0))+1
+        stem=os.path.basename(live).rsplit(".",1)[0]
+        sealed=os.path.join(SEG_DIR, f"{stem}.{m['seq']:06d}.jsonl")
+        # carry open work forward so readers of the live file never miss it
+        carry=[r for r in load_live(live) if not is_terminal(r)]
+        tmp=live+".new"
+        with open(tmp,"w",encoding="utf-8") as nf:
+            for r in carry:
+                nf.write(json.dumps(r, ensure_ascii=False)+"\n")
+        # seal the current inode, then swap the path atomically; writers
+        # blocked on our lock notice the inode change and reopen
+        try: os.link(live, sealed)
+        except OSError: shutil.copyfile(live, sealed)
+        os.replace(tmp, live)
+        m["sealed"]=list(m.get("sealed",[]))+[os.path.relpath(sealed, QDIR)]
+        m["live_created"]=int(time.time())
+        save_manifest(live, m)
+        print(f">>> [queue_segments] rotated {os.path.basename(live)} -> {os.path.basename(sealed)} carried={len(carry)}")
+        return sealed
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+def maybe_rotate(paths=None):
+    for p in (paths or LOGS):
+        try:
+            if needs_rotation(p): rotate(p)
+        except Exception as e:
+            print(f">>> [queue_segments] rotate failed {p}: {e}")
+
+# ---------- compactor ----------
+
+def compact(live):
+    m=load_manifest(live)
+    sealed=list(m.get("sealed",[]))
+    if not sealed: return 0
+    stem=os.path.basename(live).rsplit(".",1)[0]
+    archive=m.get("archive") or os.path.relpath(os.path.join(SEG_DIR, f"{stem}.archive.jsonl"), QDIR)
+    done=0
+    with open(os.path.join(QDIR, archive),"a",encoding="utf-8") as af:
+        for rel in sealed:
+            # non-terminal records were carried forward at rotation time
+            for r in load_live(os.path.join(QDIR, rel)):
+                if is_terminal(r):
+                    af.write(json.dumps(r, ensure_ascii=False, separators=(",",":"))+"\n")
+                    done+=1
+    f=_open_locked(live)
+    try:
+        m=load_manifest(live)
+        m["sealed"]=[s for s in m.get("sealed",[]) if s not in sealed]
+        m["archive"]=archive
+        m["archived_records"]=int(m.get("archived_records",0))+done
+        save_manifest(live, m)
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+    for rel in sealed:
+        try: os.remove(os.path.join(QDIR, rel))
+        except FileNotFoundError: pass
+    print(f">>> [queue_segments] compacted {os.path.basename(live)} segments={len(sealed)} archived={done}")
+    return done
+
+def compactor_loop(interval=60):
+    print(f">>> [queue_segments] compactor started interval={interval}s")
+    while True:
+        for p in LOGS:
+            try:
+                if needs_rotation(p): rotate(p)
+                compact(p)
+            except Exception as e:
+                print(f">>> [queue_segments] compact failed {p}: {e}")
+        time.sleep(interval)
+
+def main():
+    cmd=sys.argv[1] if len(sys.argv)>1 else "compact"
+    if cmd=="rotate":
+        for p in LOGS: rotate(p, force="--force" in sys.argv)
+    elif cmd=="compact":
+        for p in LOGS: compact(p)
+    elif cmd=="loop":
+        compactor_loop(int(sys.argv[2]) if len(sys.argv)>2 else 60)
+    else:
+        print("Usage: python scripts/ops/queue_segments.py {rotate [--force]|compact|loop [SECONDS]}")
+        sys.exit(1)
+
+if __name__=="__main__":
+    main()
@@ -46,6 +46,7 @@ PY
       -d "$(python - <<PY
 import json
 print(json.dumps({
+  "runner_id": "$RUNNER_ID",
   "task_id": int("$tid"),
   "ok": True,
   "result": {"rc": $rc, "stdout_tail": """$out_tail""", "stderr_tail": """$err_tail""", "out_log": "$out", "err_log": "$err"}
@@ -58,6 +59,7 @@ PY
       -d "$(python - <<PY
 import json
 print(json.dumps({
+  "runner_id": "$RUNNER_ID",
   "task_id": int("$tid"),
   "ok": False,
   "error": "command_failed",
@@ -107,7 +109,7 @@ PY
     # unsupported task type
     curl -s -X POST "$BASE_URL/agent/tasks/result" \
       -H "x-runner-key: $RUNNER_KEY" -H "Content-Type: application/json" \
-      -d "{\"task_id\":$tid,\"ok\":false,\"error\":\"unsupported_task_type\"}" >/dev/null || true
+      -d "{\"runner_id\":\"$RUNNER_ID\",\"task_id\":$tid,\"ok\":false,\"error\":\"unsupported_task_type\"}" >/dev/null || true
     continue
   fi
 